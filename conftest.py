@@ -0,0 +1 @@
+# Raiz do repositório no sys.path dos testes (rima_core, rima_synth)
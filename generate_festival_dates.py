@@ -5,17 +5,25 @@
 # ================================================
 
 import hashlib
-import json
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from functools import partial
 from io import BytesIO
-from zipfile import ZipFile, ZIP_DEFLATED
-from datetime import datetime
-import os
 
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
 
+from rima_core import (
+    DEFAULT_WINDOW_MIN, DEFAULT_MIN_CONSEC, DEFAULT_MIN_COMB, THRESH_PAX_CONSEC_DEFAULT, THRESH_PAX_COMBI_DEFAULT,
+    DEFAULT_MIN_POSITIONS, WINDOW_MIN_RANGE, PREP_RULES_VERSION, EXPORT_FORMATS, fmt_int, write_table, prepare_rima_file, profile_stage,
+    ANALYSES, analysis_key, run_analysis, wide_group_view, wide_group_chunks, minutes_with_positions,
+    build_kpi_cube, slice_kpi_cube, history_manifest, history_ingest, history_span, history_fingerprint, history_load,
+    audit_metadata, write_audit_zip, add_audit_metadata,
+)
+
 st.set_page_config(page_title="Análise RIMA", layout="wide")
 title_placeholder = st.empty()
 
@@ -34,185 +42,181 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-DEFAULT_WINDOW_MIN = 45
-DEFAULT_MIN_CONSEC = 3
-DEFAULT_MIN_COMB = 4
-THRESH_PAX_CONSEC_DEFAULT = 484
-THRESH_PAX_COMBI_DEFAULT = 580
-
 DEFAULT_COLORS = ["#0073e6", "#d62728", "#ff7f0e", "#2ca02c", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
 PREFERRED_COLORS = {"AZU": "#0073e6","ACN":"#0073e6","TAM": "#d62728","GLO": "#ff7f0e","PAM": "#ffdd44"}
+GROUPS_PAGE_SIZE = 500  # grupos por página nas abas; o layout largo só é montado para a página exibida
+ANALYSIS_WORKERS = 4  # threads compartilhadas por todas as sessões do servidor
+ANALYSIS_KEEP = 16  # resultados concluídos guardados por sessão (voltar a parâmetros anteriores não recalcula)
+ANALYSIS_POLL_S = 0.1
+SOURCES = ("Arquivo carregado", "Histórico acumulado")
 
-def fmt_int(x):
-    try:
-        return f"{int(x):,}".replace(",", ".")
-    except Exception:
-        return str(x)
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_prepared_rima(sha, _file_bytes, _name="rima.xlsx", version=PREP_RULES_VERSION):
+    """Dados limpos/descartados por (SHA-256, versão das regras): memória → Parquet local → arquivo RIMA.
 
-def df_to_excel_bytes(df, sheet="Dados"):
-    out = BytesIO()
-    with pd.ExcelWriter(out, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name=sheet)
+    Devolve também o perfil das etapas de leitura/preparo, medido no carregamento (reaproveitado junto com os dados).
+    """
+    profile = []
+    clean, discarded, rows_original = prepare_rima_file(_file_bytes, _name, sha=sha, version=version, profile=profile)
+    return clean, discarded, rows_original, profile
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_history_range(fingerprint, start, end):
+    """Movimentos do histórico no período; fingerprint (history_fingerprint) muda só se algum mês do período recebeu dados.
+
+    Nesse caso o período inteiro é relido e índice, ocupação, KPIs e análises são recalculados do zero.
+    """
+    return history_load(start, end)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_file_cache(sha):
+    # Índice multi-janela e ocupação do pátio por arquivo (hash), completados pelas próprias análises
+    return {'index': {}, 'occupancy': None, 'exports': []}
+
+@st.cache_resource(show_spinner=False)
+def get_analysis_pool():
+    return ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="rima-analise")
+
+def _set_progress(job, frac, text):
+    job['progress'] = (frac, text)
+
+def _failed(future):
+    # Terminou com erro (não por cancelamento): o job sai da sessão para a análise ser refeita no próximo rerun
+    return future.done() and not future.cancelled() and not isinstance(future.exception(), (type(None), CancelledError))
+
+def submit_analyses(sha, df, params):
+    """Submete ao pool as análises que ainda não têm resultado para (hash, parâmetros usados por ela).
+
+    Jobs da sessão com parâmetros antigos ainda em andamento são cancelados (fila) ou interrompidos na
+    próxima etapa (cancel); concluídos ficam guardados (até ANALYSIS_KEEP) para reaproveitamento e os que
+    falharam são descartados (tentados de novo).
+    """
+    jobs = st.session_state.setdefault('analysis_jobs', {})
+    for key in [k for k, job in jobs.items() if _failed(job['future'])]:
+        del jobs[key]
+    wanted = {name: (sha, name, analysis_key(name, params)) for name in ANALYSES}
+    for key in [k for k, job in jobs.items() if k not in wanted.values() and not job['future'].done()]:
+        jobs[key]['cancel'].set()
+        jobs[key]['future'].cancel()
+        del jobs[key]
+    for name, key in wanted.items():
+        if key not in jobs:
+            job = {'progress': (0.0, "na fila"), 'cancel': threading.Event(), 'cache': get_file_cache(sha), 'profile': []}
+            job['future'] = get_analysis_pool().submit(run_analysis, name, df, params, job['cache'],
+                                                       progress=partial(_set_progress, job), cancel=job['cancel'], profile=job['profile'])
+            jobs[key] = job
+        else:
+            jobs[key] = jobs.pop(key)  # mais recente por último
+    done = [k for k, job in jobs.items() if k not in wanted.values()]
+    for key in done[:max(0, len(jobs)-ANALYSIS_KEEP)]:
+        del jobs[key]
+    return {name: jobs[key] for name, key in wanted.items()}
+
+def wait_analysis(job, label):
+    # Espera o job mostrando o progresso (as chamadas st.* permitem que um rerun interrompa a espera); None se falhou
+    if not job['future'].done():
+        bar = st.progress(0.0, text=f"{label}: {job['progress'][1]}")
+        while not job['future'].done():
+            frac, text = job['progress']
+            bar.progress(frac, text=f"{label}: {text}")
+            time.sleep(ANALYSIS_POLL_S)
+        bar.empty()
+    error = job['future'].exception()
+    if error is not None:  # mostrado na aba; o job é descartado e refeito no próximo rerun (submit_analyses)
+        st.error(f"{label}: erro na análise: {error}")
+        return None
+    return job['future'].result()
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_kpi_cube(sha, _df):
+    # Agregado (Month, Company, ArrDep) do arquivo; os filtros da aba de KPIs só fatiam o cubo
+    return build_kpi_cube(_df)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def kpi_figures(sha, arrdep, comps, colors, _cube):
+    """Métricas e gráficos mensais/totais da aba de KPIs, memoizados por (hash, filtro, cores)."""
+    color_map = dict(colors)
+    sub = slice_kpi_cube(_cube, arrdep, list(comps))
+    metrics = (int(sub['ops'].sum()), int(sub['PAX_LOCAL'].sum()), int(sub['Company'].nunique()))
+
+    ops_month = sub.groupby(['Month','Company'], observed=True)['ops'].sum().reset_index(name='Operacoes')
+    fig_ops = px.bar(ops_month, x='Month', y='Operacoes', color='Company', text=ops_month['Operacoes'].map(fmt_int), color_discrete_map=color_map, barmode='group')
+    fig_ops.update_traces(textposition='outside')
+    fig_ops.update_layout(xaxis_title="Mês", yaxis_title="Operações", showlegend=True)
+
+    pax_month = sub.groupby(['Month','Company'], observed=True)['PAX_LOCAL'].sum().reset_index(name='PAX')
+    fig_pax = px.bar(pax_month, x='Month', y='PAX', color='Company', text=pax_month['PAX'].map(fmt_int), color_discrete_map=color_map, barmode='group')
+    fig_pax.update_traces(textposition='outside')
+    fig_pax.update_layout(xaxis_title="Mês", yaxis_title="PAX Local", showlegend=True)
+
+    total_ops_cia = sub.groupby('Company', observed=True)['ops'].sum().reset_index(name='Operacoes').sort_values('Operacoes', ascending=False)
+    fig_total = px.bar(total_ops_cia, x='Company', y='Operacoes', text=total_ops_cia['Operacoes'].map(fmt_int), color='Company', color_discrete_map=color_map)
+    fig_total.update_traces(textposition='outside', showlegend=False)
+    fig_total.update_layout(xaxis_title="Companhia", yaxis_title="Operações")
+    return metrics, fig_ops, fig_pax, fig_total
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def company_pax_figure(sha, arrdep, comps, use_conn, colors, _cube):
+    # Um único trace com uma barra por companhia (antes: um go.Bar por companhia num loop)
+    color_map = dict(colors)
+    sub = slice_kpi_cube(_cube, arrdep, list(comps))
+    totals = sub.groupby('Company', observed=True)[['PAX_LOCAL','PAX_CONEXAO_DOMESTICO']].sum()
+    company_pax = totals['PAX_LOCAL'] + (totals['PAX_CONEXAO_DOMESTICO'] if use_conn else 0)
+    fig_bar = go.Figure(go.Bar(x=company_pax.index.astype(str), y=company_pax.to_numpy(), text=[f"<b>{fmt_int(v)}</b>" for v in company_pax],
+                               textposition='inside', marker_color=[color_map.get(c,'#333333') for c in company_pax.index], textfont=dict(size=14, color="white")))
+    fig_bar.update_layout(title="Passageiros Embarcados por Companhia", xaxis_title="Companhia Aérea", yaxis_title="Total de Passageiros", template="plotly_white", showlegend=False, xaxis=dict(showgrid=False), yaxis=dict(showgrid=False))
+    return fig_bar, int(company_pax.sum())
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def export_table_cached(key, fmt, _table):
+    # Só roda no clique do download; reaproveitado enquanto (hash, parâmetros, tabela, formato) não mudar.
+    # O tempo de cada exportação fica no cache do arquivo (key[0] = hash) para o painel de diagnóstico.
+    with profile_stage(get_file_cache(key[0])['exports'], f"exportar_{key[-1]}_{fmt}") as rec:
+        out = BytesIO()
+        rec['linhas_saida'] = write_table(_table() if callable(_table) else _table, out, fmt)
     return out.getvalue()
 
-def make_zip(files):
-    bio = BytesIO()
-    with ZipFile(bio, "w", compression=ZIP_DEFLATED) as zf:
-        for name, content in files:
-            zf.writestr(name, content)
-    return bio.getvalue()
-
-@st.cache_data(show_spinner=False)
-def read_excel_and_hash(file_bytes):
-    sha = hashlib.sha256(file_bytes).hexdigest()
-    df = pd.read_excel(BytesIO(file_bytes))
-    return df, sha
-
-def prepare_rima_dataframe(df_in: pd.DataFrame):
-    df = df_in.copy()
-    required = ['AERONAVE_OPERADOR','MOVIMENTO_TIPO','CALCO_DATA','CALCO_HORARIO','VOO_NUMERO','AERONAVE_TIPO','SERVICE_TYPE','PAX_LOCAL']
-    missing = [c for c in required if c not in df.columns]
-    if missing:
-        raise ValueError("Colunas ausentes no Excel RIMA: " + ", ".join(missing))
-
-    for col in ['AERONAVE_OPERADOR','MOVIMENTO_TIPO','VOO_NUMERO','AERONAVE_TIPO','SERVICE_TYPE']:
-        df[col] = df[col].astype(str).str.strip()
-
-    # Numéricos
-    df['PAX_LOCAL'] = pd.to_numeric(df['PAX_LOCAL'], errors='coerce').fillna(0).astype(int)
-    if 'PAX_CONEXAO_DOMESTICO' in df.columns:
-        df['PAX_CONEXAO_DOMESTICO'] = pd.to_numeric(df['PAX_CONEXAO_DOMESTICO'], errors='coerce').fillna(0).astype(int)
-    else:
-        df['PAX_CONEXAO_DOMESTICO'] = 0
-
-    # Filtros de escopo:
-    df['AERONAVE_OPERADOR'] = df['AERONAVE_OPERADOR'].str.upper().str.strip()
-    # ❌ NÃO restringe por lista de cias — ✅ remove apenas "GERAL"
-    df = df[~df['AERONAVE_OPERADOR'].isin(['GERAL','GENERAL','AVIAÇÃO GERAL','AVIACAO GERAL'])]
-    # Mantém a exclusão de SERVICE_TYPE == 'P' conforme sua lógica original
-    df = df[df['SERVICE_TYPE'].str.upper() != 'P']
-
-    df['_discard_reason'] = ""
-
-    # --- PARSE ROBUSTO DO CALCO_DATETIME ---
-    date_parsed = pd.to_datetime(df['CALCO_DATA'], errors='coerce').dt.normalize()
-    hora_raw = df['CALCO_HORARIO'].astype(str).str.extract(r'(\d{1,2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?)')[0]
-    time_parsed = pd.to_datetime(hora_raw, errors='coerce')
-
-    td = (pd.to_timedelta(time_parsed.dt.hour.fillna(0).astype(int), unit='h') +
-          pd.to_timedelta(time_parsed.dt.minute.fillna(0).astype(int), unit='m') +
-          pd.to_timedelta(time_parsed.dt.second.fillna(0).astype(int), unit='s'))
-
-    df['CALCO_DATETIME'] = date_parsed + td
-    invalid_dt = date_parsed.isna() | time_parsed.isna()
-    df.loc[invalid_dt, '_discard_reason'] += "Data/Hora inválida; "
-
-    # Assentos ofertados (inclui C208 = 9 e mantém regras A20N/A320 por cia)
-    pax_mapping = {
-        'C208': 9,  # Azul Conecta
-        '738W': 186,'A319': 140,'AT45': 47,'AT75': 70,'AT76': 70,
-        'B38M': 186,'B737': 138,'B738': 186,'E195': 118,'E295': 136,
-        'A21N': 220,'A321': 220
-    }
-    def map_seats_offered(op, typ):
-        typ = str(typ).upper().strip()
-        if typ in ['A20N','A320']:
-            return 174 if str(op).upper().strip() == 'AZU' else 176
-        return pax_mapping.get(typ, 0)
-    df['SEATS_OFFERED'] = df.apply(lambda r: map_seats_offered(r['AERONAVE_OPERADOR'], r['AERONAVE_TIPO']), axis=1)
-
-    discarded = df[df['_discard_reason'] != ""].copy()
-    discarded['_discard_reason'] = discarded['_discard_reason'].str.rstrip("; ").str.strip()
-
-    clean = df[df['_discard_reason'] == ""].copy().sort_values('CALCO_DATETIME').reset_index(drop=True)
-
-    clean['Date'] = clean['CALCO_DATETIME'].dt.date
-    clean['DateTime'] = clean['CALCO_DATETIME']
-    clean['ArrDep'] = clean['MOVIMENTO_TIPO'].str.upper().map({'P':'A','D':'D'})
-    clean['Company'] = clean['AERONAVE_OPERADOR'].astype(str).str.strip()
-    clean['Fltno'] = clean['VOO_NUMERO'].astype(str).str.strip()
-    clean['Actyp'] = clean['AERONAVE_TIPO'].astype(str).str.strip()
-
-    cols_keep = ['CALCO_DATA','CALCO_HORARIO','AERONAVE_OPERADOR','MOVIMENTO_TIPO','VOO_NUMERO','AERONAVE_TIPO','SERVICE_TYPE','PAX_LOCAL','PAX_CONEXAO_DOMESTICO','BOX','CABECEIRA','_discard_reason']
-    cols_keep = [c for c in cols_keep if c in discarded.columns]
-    return clean, discarded[cols_keep], None
-
-def consecutive_groups(df, tipo, window_min, min_size):
-    sub = df[df['ArrDep']==tipo].reset_index(drop=True)
-    res, counts, start = [], {}, 0
-    for end in range(len(sub)):
-        while (sub.loc[end,'DateTime'] - sub.loc[start,'DateTime']).total_seconds() > window_min*60:
-            start += 1
-        size = end-start+1
-        if size>=min_size:
-            counts[size] = counts.get(size,0)+1
-            block=sub.iloc[start:end+1]
-            rec={}
-            for i, (_, r) in enumerate(block.iterrows(), start=1):
-                rec[f"{i}th DateTime"]=r['DateTime'].strftime('%d/%m/%Y %H:%M')
-                rec[f"{i}th Flight"]=f"{r['AERONAVE_OPERADOR']} {r['Fltno']} - {r['Actyp']}"
-            rec['PAX (Local)']=int(block['PAX_LOCAL'].sum())
-            rec['Seats Offered']=int(block['SEATS_OFFERED'].sum())
-            res.append(rec)
-    out=pd.DataFrame(res).fillna('---')
-    if not out.empty:
-        cols=[c for c in out.columns if c not in ['PAX (Local)','Seats Offered']]
-        out=out[cols+['PAX (Local)','Seats Offered']]
-    return out, dict(sorted(counts.items(), reverse=True))
-
-def combined_groups(df, window_min, min_ops):
-    res, counts, start = [], {}, 0
-    for end in range(len(df)):
-        while (df.loc[end,'DateTime'] - df.loc[start,'DateTime']).total_seconds() > window_min*60:
-            start += 1
-        block=df.iloc[start:end+1]
-        if len(block)>=min_ops:
-            a=(block['ArrDep']=='A').sum(); d=(block['ArrDep']=='D').sum()
-            if a>0 and d>0:
-                combo=f"{int(a)} Pousos e {int(d)} Decolagens"
-                counts[combo]=counts.get(combo,0)+1
-                rec={}
-                for i,(_,r) in enumerate(block.iterrows(), start=1):
-                    sig="(A)" if r['ArrDep']=='A' else "(D)"
-                    rec[f"{i}th DateTime"]=r['DateTime'].strftime('%d/%m/%Y %H:%M')
-                    rec[f"{i}th Flight"]=f"{r['AERONAVE_OPERADOR']} {r['Fltno']} {sig} - {r['Actyp']}"
-                rec['Combination Type']=combo
-                rec['PAX (Local)']=int(block['PAX_LOCAL'].sum())
-                rec['Seats Offered']=int(block['SEATS_OFFERED'].sum())
-                res.append(rec)
-    out=pd.DataFrame(res).fillna('---')
-    if not out.empty:
-        cols=[c for c in out.columns if c not in ['Combination Type','PAX (Local)','Seats Offered']]
-        out=out[cols+['Combination Type','PAX (Local)','Seats Offered']]
-    return out, counts
-
-def days_four_plus_positions(df):
-    rows=[]
-    for date,g in df.sort_values('DateTime').groupby(df['DateTime'].dt.date):
-        current=0
-        for _,r in g.iterrows():
-            if r['ArrDep']=='A':
-                current+=1
-                if current>=4:
-                    rows.append({'Date':pd.to_datetime(date).strftime('%d/%m/%Y'),
-                                 'Time':r['DateTime'].strftime('%H:%M'),
-                                 'Last Flight':f"{r['AERONAVE_OPERADOR']} {r['Fltno']}",
-                                 'Positions':current})
-            else:
-                current-=1
-    return pd.DataFrame(rows)
+@st.cache_data(show_spinner=False, max_entries=8)
+def audit_tables_zip_cached(key, fmt, _meta, _tables):
+    # Só as tabelas (caras) ficam em cache; _meta aqui só dá o nome da tabela de posições, que já está em key
+    out = BytesIO()
+    exports = write_audit_zip(out, _meta, *_tables, fmt=fmt, with_metadata=False)
+    return out.getvalue(), exports
+
+def audit_zip(key, fmt, meta, tables):
+    # metadata.json é sempre o da execução atual (generated_at_utc, perfil), mesmo com as tabelas vindas do cache
+    data, exports = audit_tables_zip_cached(key, fmt, meta, tables)
+    return add_audit_metadata(data, meta, exports)
+
+def group_page(groups, tipo, key):
+    """Layout largo apenas da página de grupos selecionada."""
+    pages = max(1, -(-len(groups)//GROUPS_PAGE_SIZE))
+    page = 1
+    if pages > 1:
+        if st.session_state.get(key, 1) > pages:
+            st.session_state[key] = pages
+        page = st.number_input(f"Página (de {pages})", min_value=1, max_value=pages, value=1, step=1, key=key)
+        st.caption(f"Grupos {fmt_int((page-1)*GROUPS_PAGE_SIZE+1)}–{fmt_int(min(page*GROUPS_PAGE_SIZE, len(groups)))} de {fmt_int(len(groups))}")
+    return wide_group_view(df, groups.iloc[(page-1)*GROUPS_PAGE_SIZE: page*GROUPS_PAGE_SIZE], tipo)
 
 with st.sidebar:
     st.header("Parâmetros")
-    window_min = st.slider("Janela (min)", 30, 120, DEFAULT_WINDOW_MIN, 5)
+    window_min = st.slider("Janela (min)", WINDOW_MIN_RANGE[0], WINDOW_MIN_RANGE[1], DEFAULT_WINDOW_MIN, WINDOW_MIN_RANGE[2])
     min_consec = st.number_input("Mínimo de voos (Consecutivos)", value=DEFAULT_MIN_CONSEC, min_value=2, step=1)
     min_comb = st.number_input("Mínimo de operações (Combinados A+D)", value=DEFAULT_MIN_COMB, min_value=3, step=1)
     THRESH_PAX_CONSEC = st.number_input("Limiar PAX Local (Consecutivos)", value=THRESH_PAX_CONSEC_DEFAULT, step=10)
     THRESH_PAX_COMBI = st.number_input("Limiar PAX Local (Combinados)", value=THRESH_PAX_COMBI_DEFAULT, step=10)
+    min_positions = st.number_input("Mínimo de posições ocupadas", value=DEFAULT_MIN_POSITIONS, min_value=1, step=1)
     only_over_threshold = st.checkbox("Mostrar apenas grupos com PAX ≥ limiar")
-    uploaded = st.file_uploader("Carregue o RIMA (xls/xlsx)", type=["xls","xlsx"])
-
-if uploaded is None:
+    cluster_mode = st.checkbox("Agrupar janelas sobrepostas (clusters)", help="Funde janelas qualificadas que compartilham voos em um único cluster de congestionamento")
+    export_fmt = st.selectbox("Formato das exportações", EXPORT_FORMATS, format_func=str.upper)
+    source = st.radio("Fonte dos dados", SOURCES, horizontal=True,
+                      help="Histórico acumulado: cada RIMA carregado é acrescentado (sem duplicar movimentos) e a análise cobre o período escolhido")
+    use_history = source == SOURCES[1]
+    uploaded = st.file_uploader("Carregue o RIMA (xls/xlsx/csv/parquet)", type=["xls","xlsx","csv","parquet"])
+
+def show_start_page(message=None):
+    # Tela inicial (sem dados para analisar): só o cabeçalho e, se houver, o aviso
     title_placeholder.markdown(
         f"""
         <div class="header-container">
@@ -226,17 +230,54 @@ if uploaded is None:
         """,
         unsafe_allow_html=True
     )
+    if message:
+        st.info(message)
     st.stop()
 
-file_bytes = uploaded.getvalue() if hasattr(uploaded,"getvalue") else uploaded.read()
-raw_df, sha = read_excel_and_hash(file_bytes)
-sha12 = sha[:12]
+HISTORY_EMPTY_MSG = "Histórico vazio: carregue um RIMA para começar o acúmulo."
+if uploaded is None and not (use_history and history_span(history_manifest()) is not None):
+    show_start_page(HISTORY_EMPTY_MSG if use_history else None)
 
-try:
-    df, discarded_df, _ = prepare_rima_dataframe(raw_df)
-except Exception as e:
-    st.error(f"Erro ao preparar o arquivo: {e}")
-    st.stop()
+run_profile = []  # etapas desta execução do script (painel de diagnóstico e metadata.json)
+if uploaded is not None:
+    with profile_stage(run_profile, "upload_hash"):
+        file_bytes = uploaded.getvalue() if hasattr(uploaded,"getvalue") else uploaded.read()
+        sha = hashlib.sha256(file_bytes).hexdigest()
+    try:
+        with profile_stage(run_profile, "carregar_dados") as rec:
+            df, discarded_df, rows_original, prep_profile = load_prepared_rima(sha, file_bytes, getattr(uploaded, "name", "rima.xlsx"))
+            rec['linhas_saida'] = len(df)
+        run_profile.extend(prep_profile)
+    except Exception as e:
+        st.error(f"Erro ao preparar o arquivo: {e}")
+        st.stop()
+
+if use_history:
+    # O arquivo carregado entra no histórico (idempotente por hash); as abas passam a cobrir o período escolhido
+    if uploaded is not None:
+        try:
+            ingest = history_ingest(df, sha, getattr(uploaded, "name", "rima.xlsx"), profile=run_profile)
+        except Exception as e:
+            st.error(f"Erro ao gravar no histórico: {e}")
+            st.stop()
+        st.sidebar.caption(f"{ingest['arquivo']}: {fmt_int(ingest['novos'])} movimentos novos no histórico, "
+                           f"{fmt_int(ingest['duplicados'])} já existentes")
+    manifest = history_manifest()
+    span = history_span(manifest)
+    if span is None:  # só arquivos sem movimentos válidos até agora
+        show_start_page(HISTORY_EMPTY_MSG)
+    first_day, last_day = (d.date() for d in span)
+    period = st.sidebar.date_input("Período do histórico", value=(first_day, last_day), min_value=first_day, max_value=last_day, format="DD/MM/YYYY")
+    start, end = (period[0], period[-1]) if isinstance(period, (tuple, list)) and period else (first_day, last_day)
+    sha = history_fingerprint(manifest, start, end)
+    with profile_stage(run_profile, "carregar_historico") as rec:
+        df = load_history_range(sha, start, end)
+        rec['linhas_saida'] = len(df)
+    if df.empty:
+        st.info("Nenhum movimento no período escolhido.")
+        st.stop()
+    discarded_df, rows_original = pd.DataFrame(), len(df)  # descartes ficam com cada arquivo; o histórico guarda só movimentos válidos
+sha12 = sha[:12]
 
 title_placeholder.markdown(
     f"""
@@ -253,15 +294,26 @@ title_placeholder.markdown(
 )
 
 with st.expander("Saúde do dado • integridade e qualidade", expanded=True):
-    st.write(f"**Hash do arquivo (SHA-256):** `{sha12}`")
-    c1,c2,c3 = st.columns(3)
-    c1.metric("Linhas totais", fmt_int(len(raw_df)))
-    c2.metric("Linhas válidas", fmt_int(len(df)))
-    c3.metric("Descartadas", fmt_int(len(discarded_df)))
-    if len(discarded_df)>0:
-        st.markdown("**Registros descartados (com motivo):**")
-        st.dataframe(discarded_df.rename(columns={'_discard_reason':'Motivo'}), use_container_width=True, hide_index=True)
-        st.download_button("Baixar descartados (XLSX)", data=df_to_excel_bytes(discarded_df.rename(columns={'_discard_reason':'Motivo'})), file_name="descartados.xlsx")
+    if use_history:
+        st.write(f"**Histórico:** {start:%d/%m/%Y} a {end:%d/%m/%Y} • chave do período `{sha12}`")
+        c1,c2,c3 = st.columns(3)
+        c1.metric("Arquivos no histórico", fmt_int(len(manifest['files'])))
+        c2.metric("Meses no histórico", fmt_int(len(manifest['months'])))
+        c3.metric("Movimentos no período", fmt_int(len(df)))
+        st.dataframe(pd.DataFrame(manifest['files'], columns=['arquivo','ingerido_em_utc','linhas_validas','novos','duplicados','inicio','fim']),
+                     use_container_width=True, hide_index=True)
+    else:
+        st.write(f"**Hash do arquivo (SHA-256):** `{sha12}`")
+        c1,c2,c3 = st.columns(3)
+        c1.metric("Linhas totais", fmt_int(rows_original))
+        c2.metric("Linhas válidas", fmt_int(len(df)))
+        c3.metric("Descartadas", fmt_int(len(discarded_df)))
+        if len(discarded_df)>0:
+            st.markdown("**Registros descartados (com motivo):**")
+            st.dataframe(discarded_df.rename(columns={'_discard_reason':'Motivo'}), use_container_width=True, hide_index=True)
+            st.download_button(f"Baixar descartados ({export_fmt.upper()})", data=partial(export_table_cached, (sha, 'descartados'), export_fmt, discarded_df.rename(columns={'_discard_reason':'Motivo'})), file_name=f"descartados.{export_fmt}")
+
+diagnostics = st.expander("Diagnóstico • tempo e memória por etapa", expanded=False)
 
 companies = sorted(df['Company'].unique().tolist())
 if 'color_map' not in st.session_state:
@@ -273,58 +325,80 @@ if 'color_map' not in st.session_state:
     st.session_state.color_map = auto
 color_map = st.session_state.color_map
 
-tab1, tab2, tab3, tab4, tab5 = st.tabs(["Pousos Consecutivos (A)","Decolagens Consecutivas (D)","Operações Combinadas (A+D)","4+ Posições","Gráficos & KPIs"])
+analysis_params = {'window_min': int(window_min), 'min_consec': int(min_consec), 'min_comb': int(min_comb),
+                   'thresh_consec': int(THRESH_PAX_CONSEC), 'thresh_comb': int(THRESH_PAX_COMBI),
+                   'only_over_threshold': bool(only_over_threshold), 'clusters': bool(cluster_mode), 'min_positions': int(min_positions)}
+jobs = submit_analyses(sha, df, analysis_params)
+pax_col_view = 'Peak PAX (Local)' if cluster_mode else 'PAX (Local)'
+export_key = (sha, int(window_min), int(min_consec), int(min_comb), int(THRESH_PAX_CONSEC), int(THRESH_PAX_COMBI), bool(only_over_threshold), bool(cluster_mode), int(min_positions))
+
+tab1, tab2, tab3, tab4, tab5 = st.tabs(["Pousos Consecutivos (A)","Decolagens Consecutivas (D)","Operações Combinadas (A+D)",f"{int(min_positions)}+ Posições","Gráficos & KPIs"])
 
 with tab1:
-    A_df, A_cnt = consecutive_groups(df,'A', window_min, int(min_consec))
-    if only_over_threshold and not A_df.empty:
-        A_df = A_df[A_df['PAX (Local)']>=THRESH_PAX_CONSEC]
-    if A_df.empty:
-        st.info("Sem ocorrências de pousos consecutivos.")
-    else:
-        for k,v in A_cnt.items():
-            st.markdown(f"**Total de {k:02d} pousos consecutivos:** {fmt_int(v)}")
-        view = A_df.reset_index(drop=True)
-        st.dataframe(view.style.applymap(lambda v: 'color: red; font-weight: bold;' if isinstance(v,int) and v>=THRESH_PAX_CONSEC else '', subset=['PAX (Local)']), use_container_width=True, hide_index=True)
-        st.download_button("Baixar XLSX", data=df_to_excel_bytes(view), file_name="Pousos_Consecutivos.xlsx")
+    A_res = wait_analysis(jobs['A'], "Pousos consecutivos")
+    run_profile.extend(jobs['A']['profile'])
+    if A_res is not None:
+        A_grp, A_cnt = A_res
+        with profile_stage(run_profile, "render_A", len(A_grp)):
+            if A_grp.empty:
+                st.info("Sem ocorrências de pousos consecutivos.")
+            else:
+                for k,v in A_cnt.items():
+                    st.markdown(f"**Clusters com pico de {k:02d} pousos consecutivos:** {fmt_int(v)}" if cluster_mode else f"**Total de {k:02d} pousos consecutivos:** {fmt_int(v)}")
+                view = group_page(A_grp, 'A', key="page_A")
+                st.dataframe(view.style.applymap(lambda v: 'color: red; font-weight: bold;' if isinstance(v,int) and v>=THRESH_PAX_CONSEC else '', subset=[pax_col_view]), use_container_width=True, hide_index=True)
+                st.download_button(f"Baixar {export_fmt.upper()}", data=partial(export_table_cached, export_key+('A',), export_fmt, partial(wide_group_chunks, df, A_grp, 'A')), file_name=f"Pousos_Consecutivos.{export_fmt}")
 
 with tab2:
-    D_df, D_cnt = consecutive_groups(df,'D', window_min, int(min_consec))
-    if only_over_threshold and not D_df.empty:
-        D_df = D_df[D_df['PAX (Local)']>=THRESH_PAX_CONSEC]
-    if D_df.empty:
-        st.info("Sem ocorrências de decolagens consecutivas.")
-    else:
-        for k,v in D_cnt.items():
-            st.markdown(f"**Total de {k:02d} decolagens consecutivas:** {fmt_int(v)}")
-        view = D_df.reset_index(drop=True)
-        st.dataframe(view.style.applymap(lambda v: 'color: red; font-weight: bold;' if isinstance(v,int) and v>=THRESH_PAX_CONSEC else '', subset=['PAX (Local)']), use_container_width=True, hide_index=True)
-        st.download_button("Baixar XLSX", data=df_to_excel_bytes(view), file_name="Decolagens_Consecutivas.xlsx")
+    D_res = wait_analysis(jobs['D'], "Decolagens consecutivas")
+    run_profile.extend(jobs['D']['profile'])
+    if D_res is not None:
+        D_grp, D_cnt = D_res
+        with profile_stage(run_profile, "render_D", len(D_grp)):
+            if D_grp.empty:
+                st.info("Sem ocorrências de decolagens consecutivas.")
+            else:
+                for k,v in D_cnt.items():
+                    st.markdown(f"**Clusters com pico de {k:02d} decolagens consecutivas:** {fmt_int(v)}" if cluster_mode else f"**Total de {k:02d} decolagens consecutivas:** {fmt_int(v)}")
+                view = group_page(D_grp, 'D', key="page_D")
+                st.dataframe(view.style.applymap(lambda v: 'color: red; font-weight: bold;' if isinstance(v,int) and v>=THRESH_PAX_CONSEC else '', subset=[pax_col_view]), use_container_width=True, hide_index=True)
+                st.download_button(f"Baixar {export_fmt.upper()}", data=partial(export_table_cached, export_key+('D',), export_fmt, partial(wide_group_chunks, df, D_grp, 'D')), file_name=f"Decolagens_Consecutivas.{export_fmt}")
 
 with tab3:
-    C_df, C_cnt = combined_groups(df, window_min, int(min_comb))
-    if only_over_threshold and not C_df.empty:
-        C_df = C_df[C_df['PAX (Local)']>=THRESH_PAX_COMBI]
-    if C_df.empty:
-        st.info("Sem ocorrências de operações combinadas.")
-    else:
-        for combo,total in C_cnt.items():
-            st.markdown(f"**Total de {combo}:** {fmt_int(total)}")
-        view = C_df.reset_index(drop=True)
-        st.dataframe(view.style.applymap(lambda v: 'color: red; font-weight: bold;' if isinstance(v,int) and v>=THRESH_PAX_COMBI else '', subset=['PAX (Local)']), use_container_width=True, hide_index=True)
-        st.download_button("Baixar XLSX", data=df_to_excel_bytes(view), file_name="Operacoes_Combinadas.xlsx")
+    C_res = wait_analysis(jobs['C'], "Operações combinadas")
+    run_profile.extend(jobs['C']['profile'])
+    if C_res is not None:
+        C_grp, C_cnt = C_res
+        with profile_stage(run_profile, "render_C", len(C_grp)):
+            if C_grp.empty:
+                st.info("Sem ocorrências de operações combinadas.")
+            else:
+                for combo,total in C_cnt.items():
+                    st.markdown(f"**Clusters com pico de {combo}:** {fmt_int(total)}" if cluster_mode else f"**Total de {combo}:** {fmt_int(total)}")
+                view = group_page(C_grp, None, key="page_C")
+                st.dataframe(view.style.applymap(lambda v: 'color: red; font-weight: bold;' if isinstance(v,int) and v>=THRESH_PAX_COMBI else '', subset=[pax_col_view]), use_container_width=True, hide_index=True)
+                st.download_button(f"Baixar {export_fmt.upper()}", data=partial(export_table_cached, export_key+('C',), export_fmt, partial(wide_group_chunks, df, C_grp, None)), file_name=f"Operacoes_Combinadas.{export_fmt}")
 
 with tab4:
-    pos_df = days_four_plus_positions(df)
-    if pos_df.empty:
-        st.info("Nenhuma data com 4+ posições ocupadas.")
-    else:
-        counts = pos_df['Positions'].value_counts().sort_index()
-        for k, v in counts.items():
-            st.markdown(f"**Total de {k:02d} posições ocupadas:** {fmt_int(v)}")
-        view = pos_df.reset_index(drop=True)
-        st.dataframe(view.style.applymap(lambda v: 'color: red; font-weight: bold;', subset=['Positions']), use_container_width=True, hide_index=True)
-        st.download_button("Baixar XLSX", data=df_to_excel_bytes(view), file_name="Dias_Com_4_Posicoes.xlsx")
+    pos_df = wait_analysis(jobs['pos'], "Posições ocupadas")
+    run_profile.extend(jobs['pos']['profile'])
+    if pos_df is not None:
+        stand_occ = jobs['pos']['cache']['occupancy']
+        with profile_stage(run_profile, "render_pos", len(pos_df)):
+            if pos_df.empty:
+                st.info(f"Nenhuma data com {int(min_positions)}+ posições ocupadas.")
+            else:
+                mins = minutes_with_positions(stand_occ)
+                for k, v in mins.loc[int(min_positions):].items():
+                    st.markdown(f"**Minutos com ≥ {k:02d} posições ocupadas:** {fmt_int(v)}")
+                counts = pos_df['Positions'].value_counts().sort_index()
+                for k, v in counts.items():
+                    st.markdown(f"**Total de {k:02d} posições ocupadas:** {fmt_int(v)}")
+                st.caption(f"Permanências pareadas pouso→decolagem (operador/tipo/BOX): {fmt_int(stand_occ['paired'])} • "
+                           f"pousos sem decolagem: {fmt_int(stand_occ['lone_arrivals'])} • decolagens sem pouso: {fmt_int(stand_occ['orphan_departures'])}")
+                view = pos_df.reset_index(drop=True)
+                st.dataframe(view.style.applymap(lambda v: 'color: red; font-weight: bold;', subset=['Positions']), use_container_width=True, hide_index=True)
+                st.download_button(f"Baixar {export_fmt.upper()}", data=partial(export_table_cached, export_key+('pos',), export_fmt, view), file_name=f"Dias_Com_{int(min_positions)}_Posicoes.{export_fmt}")
 
 with tab5:
     st.subheader("KPIs Gerais (PAX Local)")
@@ -333,60 +407,48 @@ with tab5:
         tipo = st.radio("Tipo de movimento", ["Todos", "Pousos (P)", "Decolagens (D)"], horizontal=True)
     with colf2:
         sel_comp = st.multiselect("Companhias", options=companies, default=companies)
-    df_kpi = df.copy()
-    if tipo=="Pousos (P)":
-        df_kpi = df_kpi[df_kpi['ArrDep']=='A']
-    elif tipo=="Decolagens (D)":
-        df_kpi = df_kpi[df_kpi['ArrDep']=='D']
-    df_kpi = df_kpi[df_kpi['Company'].isin(sel_comp)]
-    c1,c2,c3 = st.columns(3)
-    c1.metric("Total de operações", fmt_int(len(df_kpi)))
-    c2.metric("PAX Local (somatório)", fmt_int(df_kpi['PAX_LOCAL'].sum()))
-    c3.metric("Companhias ativas", fmt_int(df_kpi['Company'].nunique()))
-    st.markdown("---")
-    st.subheader("Operações Mensais por Companhia")
-    df_kpi['Month'] = df_kpi['DateTime'].dt.to_period('M').astype(str)
-    ops_month = df_kpi.groupby(['Month','Company'])['ArrDep'].count().reset_index(name='Operacoes')
-    fig_ops = px.bar(ops_month, x='Month', y='Operacoes', color='Company', text=ops_month['Operacoes'].map(fmt_int), color_discrete_map=color_map, barmode='group')
-    fig_ops.update_traces(textposition='outside')
-    fig_ops.update_layout(xaxis_title="Mês", yaxis_title="Operações", showlegend=True)
-    st.plotly_chart(fig_ops, use_container_width=True)
-
-    st.subheader("PAX Local por Companhia (Mensal)")
-    pax_month = df_kpi.groupby(['Month','Company'])['PAX_LOCAL'].sum().reset_index(name='PAX')
-    fig_pax = px.bar(pax_month, x='Month', y='PAX', color='Company', text=pax_month['PAX'].map(fmt_int), color_discrete_map=color_map, barmode='group')
-    fig_pax.update_traces(textposition='outside')
-    fig_pax.update_layout(xaxis_title="Mês", yaxis_title="PAX Local", showlegend=True)
-    st.plotly_chart(fig_pax, use_container_width=True)
-
-    st.subheader("Total de Operações por Companhia (Período Filtrado)")
-    total_ops_cia = df_kpi.groupby('Company')['ArrDep'].count().reset_index(name='Operacoes').sort_values('Operacoes', ascending=False)
-    fig_total = px.bar(total_ops_cia, x='Company', y='Operacoes', text=total_ops_cia['Operacoes'].map(fmt_int), color='Company', color_discrete_map=color_map)
-    fig_total.update_traces(textposition='outside', showlegend=False)
-    fig_total.update_layout(xaxis_title="Companhia", yaxis_title="Operações")
-    st.plotly_chart(fig_total, use_container_width=True)
-
-    st.subheader("Passageiros Embarcados por Companhia (Local + Conexão Doméstica)")
-    use_conn = st.checkbox("Incluir PAX de conexão doméstica", value=True)
-    pax_col = 'PAX_TOTAL_calc'
-    df_kpi[pax_col] = df_kpi['PAX_LOCAL'] + (df_kpi['PAX_CONEXAO_DOMESTICO'] if use_conn else 0)
-    company_pax = df_kpi.groupby('Company')[pax_col].sum().reset_index().rename(columns={pax_col:'TOTAL_PAX'})
-    fig_bar = go.Figure()
-    for _, row in company_pax.iterrows():
-        txt = f"<b>{fmt_int(int(row['TOTAL_PAX']))}</b>"
-        fig_bar.add_trace(go.Bar(x=[row['Company']], y=[row['TOTAL_PAX']], text=txt, textposition='inside', marker_color=color_map.get(row['Company'],'#333333'), textfont=dict(size=14, color="white")))
-    fig_bar.update_layout(title="Passageiros Embarcados por Companhia", xaxis_title="Companhia Aérea", yaxis_title="Total de Passageiros", template="plotly_white", showlegend=False, xaxis=dict(showgrid=False), yaxis=dict(showgrid=False))
-    st.plotly_chart(fig_bar, use_container_width=True)
-    total_geral = int(company_pax['TOTAL_PAX'].sum())
-    st.markdown(f"<h3 style='text-align:center;'><b>Total Geral de Passageiros: {fmt_int(total_geral)}</b></h3>", unsafe_allow_html=True)
+    with profile_stage(run_profile, "render_kpi", len(df)):
+        kpi_cube = get_kpi_cube(sha, df)
+        arrdep = {"Pousos (P)": 'A', "Decolagens (D)": 'D'}.get(tipo)
+        colors = tuple(sorted(color_map.items()))
+        (n_ops, n_pax, n_comp), fig_ops, fig_pax, fig_total = kpi_figures(sha, arrdep, tuple(sel_comp), colors, kpi_cube)
+        c1,c2,c3 = st.columns(3)
+        c1.metric("Total de operações", fmt_int(n_ops))
+        c2.metric("PAX Local (somatório)", fmt_int(n_pax))
+        c3.metric("Companhias ativas", fmt_int(n_comp))
+        st.markdown("---")
+        st.subheader("Operações Mensais por Companhia")
+        st.plotly_chart(fig_ops, use_container_width=True)
+
+        st.subheader("PAX Local por Companhia (Mensal)")
+        st.plotly_chart(fig_pax, use_container_width=True)
+
+        st.subheader("Total de Operações por Companhia (Período Filtrado)")
+        st.plotly_chart(fig_total, use_container_width=True)
+
+        st.subheader("Passageiros Embarcados por Companhia (Local + Conexão Doméstica)")
+        use_conn = st.checkbox("Incluir PAX de conexão doméstica", value=True)
+        fig_bar, total_geral = company_pax_figure(sha, arrdep, tuple(sel_comp), use_conn, colors, kpi_cube)
+        st.plotly_chart(fig_bar, use_container_width=True)
+        st.markdown(f"<h3 style='text-align:center;'><b>Total Geral de Passageiros: {fmt_int(total_geral)}</b></h3>", unsafe_allow_html=True)
 
 st.subheader("Exportar pacote de auditoria")
-meta = {"hash_sha256": sha, "hash_prefix": sha12, "window_min": int(window_min), "min_consecutivos": int(min_consec), "min_combinados": int(min_comb), "threshold_pax_consecutivos": int(THRESH_PAX_CONSEC), "threshold_pax_combinados": int(THRESH_PAX_COMBI), "generated_at_utc": datetime.utcnow().isoformat()+"Z", "rows_original": int(len(raw_df)), "rows_clean": int(len(df)), "rows_discarded": int(len(discarded_df)), "airport": "RIMA", "metric_note": "PAX (Local) = embarque local conforme RIMA"}
-files = [("metadata.json", json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8"))]
-if 'A_df' in locals() and isinstance(A_df, pd.DataFrame) and not A_df.empty: files.append(("pousos_consecutivos.xlsx", df_to_excel_bytes(A_df.reset_index(drop=True))))
-if 'D_df' in locals() and isinstance(D_df, pd.DataFrame) and not D_df.empty: files.append(("decolagens_consecutivas.xlsx", df_to_excel_bytes(D_df.reset_index(drop=True))))
-if 'C_df' in locals() and isinstance(C_df, pd.DataFrame) and not C_df.empty: files.append(("operacoes_combinadas.xlsx", df_to_excel_bytes(C_df.reset_index(drop=True))))
-if 'pos_df' in locals() and isinstance(pos_df, pd.DataFrame) and not pos_df.empty: files.append(("dias_4_posicoes.xlsx", df_to_excel_bytes(pos_df.reset_index(drop=True))))
-if len(discarded_df)>0: files.append(("descartados.xlsx", df_to_excel_bytes(discarded_df.rename(columns={'_discard_reason':'Motivo'}))))
-zip_bytes = make_zip(files)
-st.download_button(f"Baixar pacote ZIP", data=zip_bytes, file_name=f"auditoria_rima_{int(window_min)}min.zip")
+meta = audit_metadata(sha, window_min, min_consec, min_comb, THRESH_PAX_CONSEC, THRESH_PAX_COMBI, rows_original, len(df), len(discarded_df), cluster_mode, min_positions,
+                      profile=run_profile)
+if use_history:
+    meta["historico"] = {"inicio": str(start), "fim": str(end),
+                         "arquivos": [{"arquivo": f["arquivo"], "hash_sha256": f["hash_sha256"]} for f in manifest["files"]]}
+if A_res is None or D_res is None or C_res is None or pos_df is None:
+    st.info("Pacote de auditoria indisponível: alguma análise falhou (veja as abas).")
+else:
+    st.download_button(f"Baixar pacote ZIP", data=partial(audit_zip, export_key, export_fmt, meta, (partial(wide_group_chunks, df, A_grp, 'A'), partial(wide_group_chunks, df, D_grp, 'D'), partial(wide_group_chunks, df, C_grp), pos_df, discarded_df)), file_name=f"auditoria_rima_{int(window_min)}min.zip")
+
+with diagnostics:
+    # Preenchido no fim do script, quando todas as etapas desta execução já foram medidas
+    exports = get_file_cache(sha)['exports']
+    st.dataframe(pd.DataFrame(run_profile + exports[-10:]), use_container_width=True, hide_index=True)
+    st.caption("'carregar_dados' e 'render_*' são desta execução; preparo e análises reaproveitados do cache repetem o tempo de quando foram calculados. "
+               "Exportações: últimas 10 deste arquivo. "
+               "'pico_rss_mb' é o maior RSS do processo durante a etapa (só no Linux; o processo é compartilhado entre sessões e análises em paralelo), "
+               "'rss_mb' o RSS ao fim dela e 'variacao_rss_mb' quanto ele mudou; "
+               "'pico_tracemalloc_mb' só é medido com RIMA_PROFILE_TRACEMALLOC=1.")
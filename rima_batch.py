@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# ================================================
+# Análise RIMA em lote — processa uma pasta de arquivos RIMA sem navegador
+# Uso: python rima_batch.py PASTA_RIMA --saida PASTA_SAIDA [--janela 45 ...]
+# Gera um auditoria_rima_<arquivo>_<ext>_<janela>min.zip por arquivo + resumo_lote.xlsx
+# ================================================
+
+import argparse
+import hashlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from rima_core import (
+    DEFAULT_WINDOW_MIN, DEFAULT_MIN_CONSEC, DEFAULT_MIN_COMB, THRESH_PAX_CONSEC_DEFAULT, THRESH_PAX_COMBI_DEFAULT,
+    DEFAULT_MIN_POSITIONS, WINDOW_MIN_RANGE, EXPORT_FORMATS, HISTORY_DIR, df_to_excel_bytes, prepare_rima_file, profile_stage, analyze_rima, audit_group_views, audit_metadata, write_audit_zip,
+    history_ingest,
+)
+
+RIMA_EXTENSIONS = (".xls", ".xlsx", ".csv", ".parquet")
+SUMMARY_COLUMNS = ["arquivo", "hash_sha256", "rows_original", "rows_clean", "rows_discarded", "periodo_inicio", "periodo_fim",
+                   "grupos_pousos", "grupos_decolagens", "grupos_combinados", "registros_posicoes", "pacote", "erro"]
+
+def list_rima_files(folder):
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder)
+                  if f.lower().endswith(RIMA_EXTENSIONS) and not f.startswith("~$"))
+
+def process_file(path, out_dir, params, use_cache=True, fmt="xlsx"):
+    """Processa um arquivo RIMA e grava o pacote de auditoria; devolve a linha do resumo."""
+    name = os.path.basename(path)
+    row = {"arquivo": name}
+    try:
+        profile = []  # tempo/memória por etapa → "perfil" no metadata.json
+        with profile_stage(profile, "arquivo_hash"):
+            with open(path, "rb") as f:
+                file_bytes = f.read()
+            sha = hashlib.sha256(file_bytes).hexdigest()
+        df, discarded_df, rows_original = prepare_rima_file(file_bytes, name, sha=sha, use_cache=use_cache, profile=profile)
+        res = analyze_rima(df, **params, profile=profile)
+        meta = audit_metadata(sha, params["window_min"], params["min_consec"], params["min_comb"], params["thresh_consec"],
+                              params["thresh_comb"], rows_original, len(df), len(discarded_df), params.get("clusters", False), params.get("min_positions", DEFAULT_MIN_POSITIONS),
+                              profile=profile)
+        zip_name = f"auditoria_rima_{name.replace('.', '_')}_{int(params['window_min'])}min.zip"
+        with open(os.path.join(out_dir, zip_name), "wb") as f:
+            write_audit_zip(f, meta, *audit_group_views(df, res), discarded_df, fmt)
+        row.update({
+            "hash_sha256": sha, "rows_original": int(rows_original), "rows_clean": int(len(df)), "rows_discarded": int(len(discarded_df)),
+            "periodo_inicio": df['DateTime'].min() if len(df) else pd.NaT, "periodo_fim": df['DateTime'].max() if len(df) else pd.NaT,
+            "grupos_pousos": sum(res['A'][1].values()), "grupos_decolagens": sum(res['D'][1].values()),
+            "grupos_combinados": sum(res['C'][1].values()), "registros_posicoes": int(len(res['pos'])),
+            "pacote": zip_name, "erro": "",
+        })
+    except Exception as e:
+        row["erro"] = f"{type(e).__name__}: {e}"
+    return row
+
+def ingest_history(paths, history_dir, use_cache=True):
+    """Acrescenta ao histórico, um por vez e em ordem, arquivos já processados (dados preparados vêm do cache Parquet)."""
+    for path in paths:
+        name = os.path.basename(path)
+        with open(path, "rb") as f:
+            file_bytes = f.read()
+        sha = hashlib.sha256(file_bytes).hexdigest()
+        df, _, _ = prepare_rima_file(file_bytes, name, sha=sha, use_cache=use_cache)
+        rec = history_ingest(df, sha, name, history_dir)
+        if rec["ja_ingerido"]:
+            print(f"{name}: já estava no histórico")
+        else:
+            print(f"{name}: histórico +{rec['novos']} movimentos, {rec['duplicados']} duplicados")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Análise RIMA em lote: um pacote de auditoria por arquivo, em paralelo.")
+    ap.add_argument("pasta", help="Pasta com arquivos RIMA (xls/xlsx/csv/parquet)")
+    ap.add_argument("--saida", default="auditorias", help="Pasta de saída dos ZIPs e do resumo (padrão: auditorias)")
+    ap.add_argument("--janela", type=int, default=DEFAULT_WINDOW_MIN, help=f"Janela em minutos ({WINDOW_MIN_RANGE[0]}–{WINDOW_MIN_RANGE[1]})")
+    ap.add_argument("--min-consecutivos", type=int, default=DEFAULT_MIN_CONSEC, help="Mínimo de voos (Consecutivos)")
+    ap.add_argument("--min-combinados", type=int, default=DEFAULT_MIN_COMB, help="Mínimo de operações (Combinados A+D)")
+    ap.add_argument("--limiar-consecutivos", type=int, default=THRESH_PAX_CONSEC_DEFAULT, help="Limiar PAX Local (Consecutivos)")
+    ap.add_argument("--limiar-combinados", type=int, default=THRESH_PAX_COMBI_DEFAULT, help="Limiar PAX Local (Combinados)")
+    ap.add_argument("--min-posicoes", type=int, default=DEFAULT_MIN_POSITIONS, help="Mínimo de posições ocupadas no pátio")
+    ap.add_argument("--apenas-acima-limiar", action="store_true", help="Mostrar apenas grupos com PAX ≥ limiar")
+    ap.add_argument("--clusters", action="store_true", help="Fundir janelas sobrepostas em clusters máximos de congestionamento")
+    ap.add_argument("--formato", choices=EXPORT_FORMATS, default="xlsx", help="Formato das tabelas dentro do ZIP (padrão: xlsx)")
+    ap.add_argument("--processos", type=int, default=os.cpu_count(), help="Processos em paralelo (padrão: todos os núcleos)")
+    ap.add_argument("--sem-cache", action="store_true", help="Não usar/gravar o cache Parquet de dados preparados")
+    ap.add_argument("--historico", nargs="?", const=HISTORY_DIR, default=None, metavar="PASTA",
+                    help=f"Acrescentar os arquivos processados ao histórico acumulado (padrão: {HISTORY_DIR})")
+    args = ap.parse_args(argv)
+
+    files = list_rima_files(args.pasta)
+    if not files:
+        print(f"Nenhum arquivo RIMA encontrado em {args.pasta}", file=sys.stderr)
+        return 1
+    os.makedirs(args.saida, exist_ok=True)
+    params = {"window_min": args.janela, "min_consec": args.min_consecutivos, "min_comb": args.min_combinados,
+              "thresh_consec": args.limiar_consecutivos, "thresh_comb": args.limiar_combinados,
+              "only_over_threshold": args.apenas_acima_limiar, "clusters": args.clusters,
+              "min_positions": args.min_posicoes}
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=max(1, min(args.processos, len(files)))) as pool:
+        futures = [pool.submit(process_file, path, args.saida, params, not args.sem_cache, args.formato) for path in files]
+        for fut in as_completed(futures):
+            row = fut.result()
+            print(f"{row['arquivo']}: {row['erro'] or row['pacote']}")
+            rows.append(row)
+
+    summary = pd.DataFrame(rows, columns=SUMMARY_COLUMNS).sort_values("arquivo").reset_index(drop=True)
+    with open(os.path.join(args.saida, "resumo_lote.xlsx"), "wb") as f:
+        f.write(df_to_excel_bytes(summary, sheet="Resumo"))
+    if args.historico:
+        ok = summary.loc[summary["erro"] == "", "arquivo"]
+        ingest_history([os.path.join(args.pasta, name) for name in ok], args.historico, not args.sem_cache)
+    return 1 if (summary["erro"] != "").any() else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
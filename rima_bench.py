@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# ================================================
+# Benchmark das etapas da análise RIMA sobre dados sintéticos (rima_synth)
+# Uso: python rima_bench.py [--dias 30 365] [--movimentos-dia 80] [--repeticoes 3] [--saida bench_results.jsonl]
+# Cada execução acrescenta uma linha JSON por (tamanho, etapa), marcada com o commit atual; a tabela impressa
+# compara com o último commit diferente registrado no mesmo arquivo (mesmo tamanho/seed/etapa/formatos/repetições).
+# ================================================
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from rima_core import (
+    DEFAULT_WINDOW_MIN, DEFAULT_MIN_CONSEC, DEFAULT_MIN_COMB, DEFAULT_MIN_POSITIONS, THRESH_PAX_CONSEC_DEFAULT, THRESH_PAX_COMBI_DEFAULT,
+    EXPORT_FORMATS, write_table, read_rima_and_hash, prepare_rima_dataframe, build_window_index, consecutive_group_table, combined_group_table,
+    build_stand_occupancy, positions_table, build_kpi_cube, analyze_rima, audit_group_views, audit_metadata, write_audit_zip,
+)
+from rima_synth import XLSX_MAX_ROWS, synth_rima, synth_for_format
+
+BENCH_RESULTS = "bench_results.jsonl"
+
+def git_commit():
+    # Commit atual (curto) e se há alterações não commitadas nos arquivos versionados
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here, capture_output=True, text=True).stdout.strip()
+        return sha, bool(dirty)
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido", False
+
+def measure(fn, repeats=3, memory=True):
+    """(resultado, melhor tempo em s, pico em MB). O pico vem de uma execução extra sob tracemalloc (fora do tempo)."""
+    best = float("inf")
+    for _ in range(max(1, repeats)):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter()-t0)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]/2**20
+        tracemalloc.stop()
+    return out, best, peak
+
+def _rows(out):
+    if isinstance(out, tuple):
+        out = out[0]
+    return len(out) if hasattr(out, "__len__") else None
+
+def bench_size(days, daily_movements, seed=0, repeats=3, memory=True, input_fmt="xlsx", zip_fmt="xlsx"):
+    """Mede cada etapa para um tamanho; devolve uma lista de dicts (etapa, segundos, pico_mb, linhas)."""
+    raw_synth = synth_rima(days, daily_movements, seed)
+    if input_fmt == "xlsx" and len(raw_synth) > XLSX_MAX_ROWS:
+        input_fmt = "csv"
+    buf = BytesIO()
+    write_table(synth_for_format(raw_synth, input_fmt), buf, input_fmt, sheet="RIMA")
+    file_bytes, name = buf.getvalue(), f"rima_sintetico.{input_fmt}"
+    state = {}
+
+    def prepare():
+        return prepare_rima_dataframe(state['raw'])
+
+    def zip_export():
+        res = state['res']
+        meta = audit_metadata("0"*64, DEFAULT_WINDOW_MIN, DEFAULT_MIN_CONSEC, DEFAULT_MIN_COMB, THRESH_PAX_CONSEC_DEFAULT, THRESH_PAX_COMBI_DEFAULT,
+                              len(state['raw']), len(state['df']), len(state['discarded']))
+        out = BytesIO()
+        write_audit_zip(out, meta, *audit_group_views(state['df'], res), state['discarded'], zip_fmt)
+        return out.getbuffer()
+
+    stages = [
+        ("leitura", lambda: read_rima_and_hash(file_bytes, name), len(raw_synth)),
+        ("preparo", prepare, None),
+        ("indice_janelas", lambda: build_window_index(state['df']), None),
+        ("grupos_A", lambda: consecutive_group_table(state['df'], 'A', DEFAULT_WINDOW_MIN, DEFAULT_MIN_CONSEC, index=state['index']), None),
+        ("grupos_D", lambda: consecutive_group_table(state['df'], 'D', DEFAULT_WINDOW_MIN, DEFAULT_MIN_CONSEC, index=state['index']), None),
+        ("grupos_C", lambda: combined_group_table(state['df'], DEFAULT_WINDOW_MIN, DEFAULT_MIN_COMB, index=state['index']), None),
+        ("clusters_C", lambda: combined_group_table(state['df'], DEFAULT_WINDOW_MIN, DEFAULT_MIN_COMB, index=state['index'], clusters=True), None),
+        ("posicoes", lambda: positions_table(state['df'], DEFAULT_MIN_POSITIONS, occ=build_stand_occupancy(state['df'])), None),
+        ("kpi_cubo", lambda: build_kpi_cube(state['df']), None),
+        ("zip_auditoria", zip_export, None),
+    ]
+    results = []
+    for stage, fn, rows_in in stages:
+        if stage == "zip_auditoria":
+            state['res'] = analyze_rima(state['df'], index=state['index'])
+        if rows_in is None:  # entrada da etapa, antes de ela rodar: preparo lê o bruto, as demais o DataFrame limpo
+            rows_in = len(state['raw'] if stage == "preparo" else state['df'])
+        out, secs, peak = measure(fn, repeats, memory)
+        if stage == "leitura":
+            state['raw'] = out[0]
+        elif stage == "preparo":
+            state['df'], state['discarded'] = out[0], out[1]
+        elif stage == "indice_janelas":
+            state['index'] = out
+        results.append({
+            "etapa": stage, "segundos": round(secs, 6), "pico_mb": None if peak is None else round(peak, 2),
+            "linhas_entrada": int(rows_in),
+            "linhas_saida": _rows(out) if stage != "zip_auditoria" else None,
+            "bytes_saida": len(out) if stage == "zip_auditoria" else None,
+            "formato_entrada": input_fmt,
+        })
+    return results
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+BASELINE_KEYS = ("dias", "movimentos_dia", "seed", "etapa", "formato_entrada", "formato_zip", "repeticoes")
+
+def baseline_for(records, commit, rec):
+    # Último registro da mesma configuração (tamanho, seed, etapa, formatos, repetições) feito em outro commit
+    same = [r for r in records if r.get("commit") != commit and all(r.get(k) == rec[k] for k in BASELINE_KEYS)]
+    return same[-1] if same else None
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark (tempo e memória) das etapas da análise RIMA em dados sintéticos.")
+    ap.add_argument("--dias", type=int, nargs="+", default=[30, 365], help="Dias de cada tamanho (padrão: 30 365)")
+    ap.add_argument("--movimentos-dia", type=int, default=80, help="Movimentos por dia (padrão: 80)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--repeticoes", type=int, default=3, help="Execuções por etapa; vale o melhor tempo (padrão: 3)")
+    ap.add_argument("--sem-memoria", action="store_true", help="Não medir o pico de memória (tracemalloc)")
+    ap.add_argument("--formato-entrada", choices=EXPORT_FORMATS, default="xlsx", help="Formato do arquivo lido (xlsx vira csv acima do limite de linhas)")
+    ap.add_argument("--formato-zip", choices=EXPORT_FORMATS, default="xlsx", help="Formato das tabelas no ZIP de auditoria")
+    ap.add_argument("--saida", default=BENCH_RESULTS, help=f"Arquivo JSONL de resultados (padrão: {BENCH_RESULTS})")
+    args = ap.parse_args(argv)
+
+    commit, dirty = git_commit()
+    previous = load_results(args.saida)
+    env = {"commit": commit, "alterado": dirty, "data_utc": datetime.utcnow().isoformat()+"Z",
+           "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+           "plataforma": platform.platform(), "cpus": os.cpu_count()}
+    new = []
+    for days in args.dias:
+        print(f"== {days} dias × {args.movimentos_dia} movimentos/dia (seed {args.seed}) ==", flush=True)
+        print(f"{'etapa':<16}{'linhas':>10}{'tempo (s)':>12}{'pico (MB)':>12}{'base (s)':>12}{'razão':>8}")
+        for res in bench_size(days, args.movimentos_dia, args.seed, args.repeticoes, not args.sem_memoria, args.formato_entrada, args.formato_zip):
+            rec = {**env, "dias": days, "movimentos_dia": args.movimentos_dia, "seed": args.seed, "repeticoes": args.repeticoes,
+                   "formato_zip": args.formato_zip, **res}
+            base = baseline_for(previous, commit, rec)
+            ratio = f"{rec['segundos']/base['segundos']:.2f}x" if base and base['segundos'] else "-"
+            peak = "-" if rec['pico_mb'] is None else f"{rec['pico_mb']:.1f}"
+            print(f"{rec['etapa']:<16}{rec['linhas_entrada']:>10}{rec['segundos']:>12.4f}{peak:>12}{(base['segundos'] if base else float('nan')):>12.4f}{ratio:>8}", flush=True)
+            new.append(rec)
+    with open(args.saida, "a", encoding="utf-8") as f:
+        for rec in new:
+            f.write(json.dumps(rec, ensure_ascii=False, default=str)+"\n")
+    print(f"{len(new)} resultados gravados em {args.saida} (commit {commit}{' + alterações' if dirty else ''})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
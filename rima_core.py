@@ -0,0 +1,1056 @@
+# -*- coding: utf-8 -*-
+# ================================================
+# Análise RIMA — núcleo de cálculo (sem Streamlit/Plotly)
+# Usado pelo app (generate_festival_dates.py) e pelo processamento em lote (rima_batch.py)
+# ================================================
+
+import hashlib
+import json
+from concurrent.futures import CancelledError
+from contextlib import contextmanager
+from io import BytesIO, TextIOWrapper
+from zipfile import ZipFile, ZIP_DEFLATED
+from datetime import datetime
+from functools import partial
+from itertools import chain
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from pandas.io.parsers import TextParser
+
+DEFAULT_WINDOW_MIN = 45
+DEFAULT_MIN_CONSEC = 3
+DEFAULT_MIN_COMB = 4
+THRESH_PAX_CONSEC_DEFAULT = 484
+THRESH_PAX_COMBI_DEFAULT = 580
+WINDOW_MIN_RANGE = (30, 120, 5)  # (mín, máx, passo) do slider "Janela (min)"
+PREP_RULES_VERSION = 2  # incrementar ao mudar as regras de limpeza (invalida o cache de dados preparados)
+CACHE_DIR = os.environ.get("RIMA_CACHE_DIR", ".rima_cache")
+CACHE_MAX_BYTES = int(os.environ.get("RIMA_CACHE_MAX_MB", "512"))*1024*1024
+HISTORY_DIR = os.environ.get("RIMA_HISTORY_DIR", ".rima_history")  # histórico acumulado: um Parquet por mês + manifest.json
+HISTORY_KEY = ['DateTime','AERONAVE_OPERADOR','VOO_NUMERO','ArrDep']  # um movimento = data/hora + operador + voo + pouso/decolagem
+HISTORY_LOCK_TIMEOUT_S = 300  # espera máxima por outra ingestão em andamento
+HISTORY_LOCK_STALE_S = 900  # trava mais antiga que isso é de uma ingestão interrompida
+EXPORT_FORMATS = ("xlsx", "csv", "parquet")
+XLSX_STREAM_MIN_CELLS = 500_000  # linhas × colunas; acima disso o XLSX é escrito em modo write-only (memória constante)
+XLSX_STREAM_CHUNK_ROWS = 10_000
+DEFAULT_MIN_POSITIONS = 4
+STAND_MAX_STAY_H = 12  # permanência máxima assumida no pátio para movimentos sem par (e pares mais longos que isso)
+WINDOW_OPTIONS = tuple(range(WINDOW_MIN_RANGE[0], WINDOW_MIN_RANGE[1]+1, WINDOW_MIN_RANGE[2]))
+ANALYSES = ('A', 'D', 'C', 'pos')  # análises das abas, na ordem das abas
+# Parâmetros que cada análise usa: mudar os demais não invalida o resultado dela
+ANALYSIS_PARAMS = {
+    'A': ('window_min', 'min_consec', 'thresh_consec', 'only_over_threshold', 'clusters'),
+    'D': ('window_min', 'min_consec', 'thresh_consec', 'only_over_threshold', 'clusters'),
+    'C': ('window_min', 'min_comb', 'thresh_comb', 'only_over_threshold', 'clusters'),
+    'pos': ('min_positions',),
+}
+
+RIMA_REQUIRED = ['AERONAVE_OPERADOR','MOVIMENTO_TIPO','CALCO_DATA','CALCO_HORARIO','VOO_NUMERO','AERONAVE_TIPO','SERVICE_TYPE','PAX_LOCAL']
+RIMA_COLUMNS = RIMA_REQUIRED + ['PAX_CONEXAO_DOMESTICO','BOX','CABECEIRA']
+SEATS_BY_TYPE = {
+    'C208': 9,  # Azul Conecta
+    '738W': 186,'A319': 140,'AT45': 47,'AT75': 70,'AT76': 70,
+    'B38M': 186,'B737': 138,'B738': 186,'E195': 118,'E295': 136,
+    'A21N': 220,'A321': 220
+}  # A20N/A320: 174 (AZU) ou 176 (demais), tratado em prepare_rima_dataframe
+
+PROFILE_TRACEMALLOC = os.environ.get("RIMA_PROFILE_TRACEMALLOC", "") not in ("", "0")  # opt-in: lento, só para diagnóstico
+
+def _rss_mb():
+    """RSS atual do processo em MB (/proc/self/statm); None fora do Linux."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages*os.sysconf("SC_PAGE_SIZE")/2**20, 1)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+_open_stages = threading.local()  # etapas abertas nesta thread: o pico de uma etapa interna sobe para a externa
+
+def _reset_peak_rss():
+    # Zera o pico de RSS (VmHWM) do processo; False se indisponível (fora do Linux ou sem permissão)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb():
+    """Pico de RSS do processo desde o último _reset_peak_rss (VmHWM de /proc/self/status) em MB; None fora do Linux."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1])/1024, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+@contextmanager
+def profile_stage(profile, stage, rows_in=None):
+    """Mede uma etapa e acrescenta {'etapa','segundos','linhas_entrada','linhas_saida','pico_rss_mb','rss_mb','variacao_rss_mb','pico_tracemalloc_mb'} em profile.
+
+    O registro é entregue ao bloco para preencher 'linhas_saida'. 'pico_rss_mb' = maior RSS do processo durante a
+    etapa: o pico (VmHWM) é zerado no início dela e lido no fim; etapas internas zeram de novo e repassam o pico
+    delas à externa. Só no Linux (None nos demais) e, como o RSS é do processo, etapas simultâneas em outras
+    threads entram na conta e podem zerar o pico umas das outras. 'rss_mb' = RSS ao fim da etapa e
+    'variacao_rss_mb' = fim - início (memória que a etapa deixou retida; pode ser negativa). Com
+    RIMA_PROFILE_TRACEMALLOC=1, a etapa mais externa liga o tracemalloc e grava em 'pico_tracemalloc_mb' o pico
+    de alocações Python durante ela (etapas aninhadas ficam com None).
+    """
+    rec = {'etapa': stage, 'segundos': None, 'linhas_entrada': rows_in, 'linhas_saida': None,
+           'pico_rss_mb': None, 'rss_mb': None, 'variacao_rss_mb': None, 'pico_tracemalloc_mb': None}
+    stack = _open_stages.__dict__.setdefault('stack', [])  # [pico já visto, etapa zerou o pico?] por etapa aberta
+    if stack:
+        stack[-1][0] = max(filter(None, (stack[-1][0], _peak_rss_mb())), default=None)
+    state = [None, _reset_peak_rss()]
+    stack.append(state)
+    traced = PROFILE_TRACEMALLOC and not tracemalloc.is_tracing()
+    if traced:
+        tracemalloc.start()
+    rss0, t0 = _rss_mb(), time.perf_counter()
+    try:
+        yield rec
+    finally:
+        rec['segundos'] = round(time.perf_counter()-t0, 4)
+        rec['rss_mb'] = _rss_mb()
+        if rss0 is not None and rec['rss_mb'] is not None:
+            rec['variacao_rss_mb'] = round(rec['rss_mb']-rss0, 1)
+        stack.pop()
+        if state[1]:
+            rec['pico_rss_mb'] = max(filter(None, (state[0], _peak_rss_mb())), default=None)
+            if stack:
+                stack[-1][0] = max(filter(None, (stack[-1][0], rec['pico_rss_mb'])), default=None)
+        if traced:
+            rec['pico_tracemalloc_mb'] = round(tracemalloc.get_traced_memory()[1]/2**20, 1)
+            tracemalloc.stop()
+        if profile is not None:
+            profile.append(rec)
+
+def fmt_int(x):
+    try:
+        return f"{int(x):,}".replace(",", ".")
+    except Exception:
+        return str(x)
+
+def _xlsx_value(v):
+    # Valores aceitos pelo openpyxl: NaN/NaT/None viram célula vazia, escalares numpy viram Python
+    if v is None or (not isinstance(v, str) and pd.isna(v)):
+        return None
+    return v.item() if isinstance(v, np.generic) else v
+
+def _peek_chunks(table):
+    # DataFrame ou iterável de blocos (DataFrames com as mesmas colunas) → (primeiro bloco ou None, iterador de todos os blocos)
+    chunks = iter([table]) if isinstance(table, pd.DataFrame) else iter(table)
+    first = next(chunks, None)
+    return first, (iter(()) if first is None else chain([first], chunks))
+
+def write_excel_stream(table, fileobj, sheet="Dados", chunk_rows=XLSX_STREAM_CHUNK_ROWS):
+    """XLSX em memória constante (openpyxl write-only): DataFrame escrito em blocos de linhas, ou blocos já prontos (iterável)."""
+    if isinstance(table, pd.DataFrame):
+        columns, chunks = table.columns, (table.iloc[i:i+chunk_rows] for i in range(0, len(table), chunk_rows))
+    else:
+        first, chunks = _peek_chunks(table)
+        columns = [] if first is None else first.columns
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet)
+    ws.append([str(c) for c in columns])
+    rows = 0
+    for chunk in chunks:
+        for row in chunk.astype(object).to_numpy():
+            ws.append([_xlsx_value(v) for v in row])
+        rows += len(chunk)
+    wb.save(fileobj)
+    return rows
+
+def _write_chunks(chunks, fileobj, fmt, sheet):
+    # Blocos gravados um a um: só um bloco materializado por vez (xlsx sempre em modo write-only)
+    rows = 0
+    if fmt == "csv":
+        text = TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+        for chunk in chunks:
+            chunk.to_csv(text, index=False, sep=";", header=rows == 0)
+            rows += len(chunk)
+        text.flush()
+        text.detach()
+    elif fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        for chunk in chunks:
+            t = pa.Table.from_pandas(_parquet_safe(chunk), preserve_index=False)
+            writer = writer or pq.ParquetWriter(fileobj, t.schema)
+            writer.write_table(t.cast(writer.schema))
+            rows += len(chunk)
+        writer.close()
+    else:
+        rows = write_excel_stream(chunks, fileobj, sheet)
+    return rows
+
+def write_table(table, fileobj, fmt="xlsx", sheet="Dados"):
+    """Grava uma tabela em fileobj binário: xlsx (openpyxl; streaming acima de XLSX_STREAM_MIN_CELLS), csv ou parquet.
+
+    table pode ser um DataFrame ou um iterável de blocos com as mesmas colunas (ex.: wide_group_chunks), gravados
+    sem montar a tabela inteira. Devolve o número de linhas gravadas.
+    """
+    if not isinstance(table, pd.DataFrame):
+        first, chunks = _peek_chunks(table)
+        if first is not None:
+            return _write_chunks(chunks, fileobj, fmt, sheet)
+        table = pd.DataFrame()
+    df = table
+    if fmt == "csv":
+        text = TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+        df.to_csv(text, index=False, sep=";")
+        text.flush()
+        text.detach()
+    elif fmt == "parquet":
+        _parquet_safe(df).to_parquet(fileobj, index=False)
+    elif df.size >= XLSX_STREAM_MIN_CELLS:
+        write_excel_stream(df, fileobj, sheet)
+    else:
+        with pd.ExcelWriter(fileobj, engine="openpyxl") as writer:
+            df.to_excel(writer, index=False, sheet_name=sheet)
+    return len(df)
+
+def export_bytes(df, fmt="xlsx", sheet="Dados"):
+    out = BytesIO()
+    write_table(df, out, fmt, sheet)
+    return out.getvalue()
+
+def df_to_excel_bytes(df, sheet="Dados"):
+    return export_bytes(df, "xlsx", sheet)
+
+def _xlsx_cell(v):
+    # Mesma conversão do leitor openpyxl do pandas: vazio → "", erro → NaN, float inteiro → int
+    if v is None:
+        return ""
+    if isinstance(v, str) and v in ERROR_CODES:
+        return np.nan
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+def _xlsx_rows(rows, idx):
+    # Projeta cada linha nas colunas pedidas; linhas vazias só saem se houver dados depois (pandas corta as finais)
+    pending = []
+    for row in rows:
+        out = [_xlsx_cell(row[i]) if i < len(row) else "" for i in idx]
+        if all(v is None or v == "" for v in row):
+            pending.append(out)
+            continue
+        yield from pending
+        pending.clear()
+        yield out
+
+def _read_xlsx_columns(file_bytes, columns):
+    """Lê só as colunas pedidas da 1ª planilha em modo read-only, linha a linha (mesma tipagem do pd.read_excel)."""
+    wb = load_workbook(BytesIO(file_bytes), read_only=True, data_only=True, keep_links=False)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [_xlsx_cell(v) for v in next(rows, ())]
+        pos = {}
+        for i, name in enumerate(header):
+            if name in columns and name not in pos:
+                pos[name] = i
+        idx = sorted(pos.values())
+        data = [[header[i] for i in idx]]
+        data.extend(_xlsx_rows(rows, idx))
+    finally:
+        wb.close()
+    if not idx:
+        return pd.DataFrame(index=pd.RangeIndex(len(data)-1))
+    return TextParser(data, header=0, skip_blank_lines=False).read()
+
+def _csv_separator(file_bytes):
+    first = file_bytes[:64*1024].split(b"\n", 1)[0]
+    return ";" if first.count(b";") > first.count(b",") else ","
+
+def _csv_dates(s):
+    # Texto dd/mm/aaaa (padrão brasileiro) vira data aqui, dia primeiro; o resto (ex.: ISO) segue para o parse do preparo,
+    # que leria "05/01/2024" como 1º de maio e descartaria "13/01/2024"
+    def parse(u):
+        br = pd.to_datetime(u.astype(str).str.strip().str.extract(r'^(\d{1,2}/\d{1,2}/\d{4})\b')[0], format='%d/%m/%Y', errors='coerce')
+        return br.astype(object).where(br.notna(), u)
+    return _parse_unique(s, parse)
+
+def _read_csv_columns(file_bytes, columns):
+    # Exportações RIMA em CSV: separador ; ou , e UTF-8 ou Latin-1; colunas de texto ficam como texto (ex.: voo "0123")
+    text_cols = {c: str for c in ['AERONAVE_OPERADOR','MOVIMENTO_TIPO','VOO_NUMERO','AERONAVE_TIPO','SERVICE_TYPE','CALCO_DATA','CALCO_HORARIO']}
+    for encoding in ("utf-8-sig", "latin-1"):
+        try:
+            df = pd.read_csv(BytesIO(file_bytes), sep=_csv_separator(file_bytes), encoding=encoding,
+                             usecols=lambda c: c in columns, dtype=text_cols)
+        except UnicodeDecodeError:
+            continue
+        if 'CALCO_DATA' in df.columns:
+            df['CALCO_DATA'] = _csv_dates(df['CALCO_DATA'])
+        return df
+
+def _read_parquet_columns(file_bytes, columns):
+    import pyarrow.parquet as pq
+    pf = pq.ParquetFile(BytesIO(file_bytes))
+    cols = [c for c in pf.schema_arrow.names if c in columns]
+    batches = [b.to_pandas() for b in pf.iter_batches(columns=cols)]
+    return pd.concat(batches, ignore_index=True) if batches else pf.read(columns=cols).to_pandas()
+
+def read_rima_and_hash(file_bytes, name="rima.xlsx", columns=RIMA_COLUMNS):
+    """Lê um RIMA (xlsx/xls/csv/parquet) trazendo apenas as colunas usadas pela análise."""
+    sha = hashlib.sha256(file_bytes).hexdigest()
+    ext = os.path.splitext(str(name).lower())[1]
+    if ext == ".csv":
+        df = _read_csv_columns(file_bytes, columns)
+    elif ext == ".parquet":
+        df = _read_parquet_columns(file_bytes, columns)
+    elif ext == ".xlsx":
+        df = _read_xlsx_columns(file_bytes, columns)
+    else:
+        df = pd.read_excel(BytesIO(file_bytes), usecols=lambda c: c in columns)
+    return df, sha
+
+def _clean_category(s, upper=False):
+    # astype(str)/strip/upper só nos valores distintos; devolve categórico alinhado ao índice original
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    labels = pd.Index(uniques).astype(str).str.strip()
+    if upper:
+        labels = labels.str.upper().str.strip()
+    cats = pd.Index(labels.unique())
+    return pd.Series(pd.Categorical.from_codes(cats.get_indexer(labels)[codes], categories=cats), index=s.index)
+
+def _parse_unique(s, parse):
+    # Aplica o parse apenas aos valores distintos (na ordem de primeira ocorrência) e redistribui
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    parsed = parse(pd.Series(uniques, dtype=object))
+    return pd.Series(parsed.to_numpy()[codes], index=s.index)
+
+def prepare_rima_dataframe(df_in: pd.DataFrame):
+    missing = [c for c in RIMA_REQUIRED if c not in df_in.columns]
+    if missing:
+        raise ValueError("Colunas ausentes no Excel RIMA: " + ", ".join(missing))
+
+    # Projeção: só as colunas usadas; texto vira categórico (limpo uma vez por valor distinto)
+    df = pd.DataFrame(index=df_in.index)
+    df['CALCO_DATA'] = df_in['CALCO_DATA']
+    df['CALCO_HORARIO'] = df_in['CALCO_HORARIO']
+    for col in ['AERONAVE_OPERADOR','MOVIMENTO_TIPO','VOO_NUMERO','AERONAVE_TIPO','SERVICE_TYPE']:
+        df[col] = _clean_category(df_in[col], upper=(col=='AERONAVE_OPERADOR'))
+
+    # Numéricos
+    df['PAX_LOCAL'] = pd.to_numeric(df_in['PAX_LOCAL'], errors='coerce').fillna(0).astype(int)
+    if 'PAX_CONEXAO_DOMESTICO' in df_in.columns:
+        df['PAX_CONEXAO_DOMESTICO'] = pd.to_numeric(df_in['PAX_CONEXAO_DOMESTICO'], errors='coerce').fillna(0).astype(int)
+    else:
+        df['PAX_CONEXAO_DOMESTICO'] = 0
+    for col in ['BOX','CABECEIRA']:
+        if col in df_in.columns:
+            df[col] = df_in[col]
+
+    # Filtros de escopo:
+    # ❌ NÃO restringe por lista de cias — ✅ remove apenas "GERAL"
+    geral = df['AERONAVE_OPERADOR'].isin(['GERAL','GENERAL','AVIAÇÃO GERAL','AVIACAO GERAL']).to_numpy()
+    # Mantém a exclusão de SERVICE_TYPE == 'P' conforme sua lógica original
+    svc = df['SERVICE_TYPE'].cat
+    service_p = np.asarray(svc.categories.str.upper() == 'P')[svc.codes.to_numpy()]
+    df = df[~geral & ~service_p]
+
+    # --- PARSE ROBUSTO DO CALCO_DATETIME ---
+    date_parsed = _parse_unique(df['CALCO_DATA'], lambda u: pd.to_datetime(u, errors='coerce')).dt.normalize()
+    hora_re = r'(\d{1,2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?)'
+    time_parsed = _parse_unique(df['CALCO_HORARIO'], lambda u: pd.to_datetime(u.astype(str).str.extract(hora_re)[0], errors='coerce'))
+    datetime_ = date_parsed + (time_parsed - time_parsed.dt.normalize()).dt.floor('s')
+    invalid_dt = (date_parsed.isna() | time_parsed.isna()).to_numpy()
+
+    # Assentos ofertados (inclui C208 = 9 e mantém regras A20N/A320 por cia): lookup por categoria
+    typ = df['AERONAVE_TIPO'].cat
+    typ_upper = typ.categories.str.upper()
+    seats_by_cat = typ_upper.map(lambda t: SEATS_BY_TYPE.get(t, 0)).to_numpy(dtype=np.int16)
+    a320_by_cat = np.asarray(typ_upper.isin(['A20N','A320']))
+    codes = typ.codes.to_numpy()
+    azu = (df['AERONAVE_OPERADOR'] == 'AZU').to_numpy()
+    seats = np.where(a320_by_cat[codes], np.where(azu, 174, 176), seats_by_cat[codes]).astype(np.int16)
+
+    discarded = df[invalid_dt].copy()
+    for col in ['AERONAVE_OPERADOR','MOVIMENTO_TIPO','VOO_NUMERO','AERONAVE_TIPO','SERVICE_TYPE']:
+        discarded[col] = discarded[col].astype(object)
+    discarded['_discard_reason'] = "Data/Hora inválida"
+
+    clean = df[~invalid_dt]
+    clean = clean.assign(DateTime=datetime_[~invalid_dt].to_numpy(), SEATS_OFFERED=seats[~invalid_dt])
+    clean = clean.sort_values('DateTime').reset_index(drop=True)
+    for col in ['AERONAVE_OPERADOR','MOVIMENTO_TIPO','VOO_NUMERO','AERONAVE_TIPO','SERVICE_TYPE']:
+        clean[col] = clean[col].cat.remove_unused_categories()
+    clean['PAX_LOCAL'] = clean['PAX_LOCAL'].astype(np.int32)
+    clean['PAX_CONEXAO_DOMESTICO'] = clean['PAX_CONEXAO_DOMESTICO'].astype(np.int32)
+
+    # Colunas derivadas: categóricos compartilham categorias (códigos de 1-2 bytes), sem cópias em texto
+    clean['Date'] = clean['DateTime'].dt.normalize()
+    clean['ArrDep'] = clean['MOVIMENTO_TIPO'].map(lambda m: {'P':'A','D':'D'}.get(m.upper())).astype('category')
+    clean['Company'] = clean['AERONAVE_OPERADOR']
+    clean['Fltno'] = clean['VOO_NUMERO']
+    clean['Actyp'] = clean['AERONAVE_TIPO']
+
+    cols_keep = ['CALCO_DATA','CALCO_HORARIO','AERONAVE_OPERADOR','MOVIMENTO_TIPO','VOO_NUMERO','AERONAVE_TIPO','SERVICE_TYPE','PAX_LOCAL','PAX_CONEXAO_DOMESTICO','BOX','CABECEIRA','_discard_reason']
+    cols_keep = [c for c in cols_keep if c in discarded.columns]
+    return clean, discarded[cols_keep], None
+
+def _cache_paths(sha, version):
+    base = os.path.join(CACHE_DIR, f"{sha}-v{version}")
+    return base+".clean.parquet", base+".discarded.parquet", base+".json"
+
+def _parquet_safe(df):
+    # Colunas object com tipos misturados (ex.: CALCO_DATA texto + data) viram texto para o Parquet
+    out = df.copy()
+    for c in out.columns:
+        if out[c].dtype == object and pd.api.types.infer_dtype(out[c], skipna=True) not in ('string','date','datetime','empty'):
+            out[c] = out[c].astype(str)
+    return out
+
+def _evict_cache(max_bytes=None):
+    # LRU por mtime (atualizado a cada leitura): remove as entradas mais antigas até caber no limite
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = {}
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        key = name.split(".",1)[0]
+        size, mtime = entries.get(key, (0, 0))
+        info = os.stat(path)
+        entries[key] = (size+info.st_size, max(mtime, info.st_mtime))
+    total = sum(size for size,_ in entries.values())
+    for key,(size,_) in sorted(entries.items(), key=lambda kv: kv[1][1]):
+        if total <= max_bytes:
+            break
+        for name in os.listdir(CACHE_DIR):
+            if name.split(".",1)[0] == key:
+                os.remove(os.path.join(CACHE_DIR, name))
+        total -= size
+
+def disk_cache_get(sha, version=PREP_RULES_VERSION):
+    clean_p, disc_p, meta_p = _cache_paths(sha, version)
+    if not all(os.path.exists(p) for p in (clean_p, disc_p, meta_p)):
+        return None
+    try:
+        clean = pd.read_parquet(clean_p)
+        discarded = pd.read_parquet(disc_p)
+        with open(meta_p, encoding="utf-8") as f:
+            meta = json.load(f)
+        for p in (clean_p, disc_p, meta_p):
+            os.utime(p)
+    except Exception:
+        return None
+    return clean, discarded, int(meta["rows_original"])
+
+def disk_cache_put(sha, clean, discarded, rows_original, version=PREP_RULES_VERSION):
+    clean_p, disc_p, meta_p = _cache_paths(sha, version)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _parquet_safe(clean).to_parquet(clean_p, index=False)
+        _parquet_safe(discarded).to_parquet(disc_p, index=True)
+        with open(meta_p, "w", encoding="utf-8") as f:
+            json.dump({"hash_sha256": sha, "rules_version": version, "rows_original": int(rows_original)}, f)
+        _evict_cache()
+    except Exception:
+        # Cache em disco é opcional (ex.: sem pyarrow ou sem permissão de escrita)
+        for p in (clean_p, disc_p, meta_p):
+            if os.path.exists(p):
+                os.remove(p)
+
+def prepare_rima_file(file_bytes, name="rima.xlsx", sha=None, use_cache=True, version=PREP_RULES_VERSION, profile=None):
+    """Lê e prepara um arquivo RIMA, reaproveitando o cache Parquet local (chave: SHA-256 + versão das regras).
+
+    Com profile (lista), registra as etapas executadas (profile_stage): cache_parquet, leitura, preparo, gravar_cache.
+    """
+    sha = sha or hashlib.sha256(file_bytes).hexdigest()
+    cached = None
+    if use_cache:
+        with profile_stage(profile, "cache_parquet") as rec:
+            cached = disk_cache_get(sha, version)
+            rec['linhas_saida'] = None if cached is None else len(cached[0])
+    if cached is not None:
+        return cached
+    with profile_stage(profile, "leitura") as rec:
+        raw_df, _ = read_rima_and_hash(file_bytes, name)
+        rec['linhas_saida'] = len(raw_df)
+    with profile_stage(profile, "preparo", len(raw_df)) as rec:
+        clean, discarded, _ = prepare_rima_dataframe(raw_df)
+        rec['linhas_saida'] = len(clean)
+    if use_cache:
+        with profile_stage(profile, "gravar_cache", len(clean)):
+            disk_cache_put(sha, clean, discarded, len(raw_df), version)
+    return clean, discarded, len(raw_df)
+
+def _history_path(history_dir, month):
+    return os.path.join(history_dir, f"movimentos-{month}.parquet")
+
+def _write_atomic(path, write):
+    # Grava em arquivo temporário e troca no fim: uma ingestão interrompida não deixa o histórico pela metade
+    tmp = path+".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+@contextmanager
+def _history_lock(history_dir, timeout=HISTORY_LOCK_TIMEOUT_S):
+    # Arquivo-trava criado com O_EXCL (atômico também no Windows); trava mais antiga que HISTORY_LOCK_STALE_S é de
+    # uma ingestão que morreu no meio e é descartada
+    path = os.path.join(history_dir, "ingest.lock")
+    t0 = time.monotonic()
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time()-os.path.getmtime(path) > HISTORY_LOCK_STALE_S:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic()-t0 > timeout:
+                raise TimeoutError(f"Histórico em {history_dir} ocupado por outra ingestão há mais de {timeout} s; tente de novo")
+            time.sleep(0.05)
+    try:
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        os.close(fd)
+        yield
+    finally:
+        os.remove(path)
+
+def history_manifest(history_dir=None):
+    """Manifesto do histórico: versão das regras, arquivos ingeridos e {mês: {'rows','version'}}."""
+    path = os.path.join(history_dir or HISTORY_DIR, "manifest.json")
+    if not os.path.exists(path):
+        return {"rules_version": PREP_RULES_VERSION, "files": [], "months": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _history_keys(df):
+    return pd.MultiIndex.from_arrays([df['DateTime'].to_numpy(dtype='datetime64[ns]')]+[df[c].astype(str).to_numpy() for c in HISTORY_KEY[1:]])
+
+def _history_frame(df):
+    # Partições lidas do Parquet → mesmo esquema de prepare_rima_dataframe (categóricos compartilhados, ordem de DateTime)
+    df = df.copy()
+    for col in ['AERONAVE_OPERADOR','MOVIMENTO_TIPO','VOO_NUMERO','AERONAVE_TIPO','SERVICE_TYPE','ArrDep']:
+        df[col] = df[col].astype(str).where(df[col].notna()).astype('category')  # NaN (ex.: ArrDep sem P/D) continua NaN
+    df = df.sort_values('DateTime', kind='stable').reset_index(drop=True)
+    df['Company'] = df['AERONAVE_OPERADOR']
+    df['Fltno'] = df['VOO_NUMERO']
+    df['Actyp'] = df['AERONAVE_TIPO']
+    return df
+
+def history_ingest(clean, sha, name="rima.xlsx", history_dir=None, profile=None):
+    """Acrescenta os movimentos limpos de um arquivo ao histórico, sem duplicar movimentos já gravados (HISTORY_KEY).
+
+    Só os meses que recebem movimentos novos são regravados e têm a versão incrementada (history_fingerprint):
+    períodos que não tocam esses meses mantêm os resultados em cache; um período que inclui algum deles é relido e
+    recalculado por inteiro (não há recálculo parcial do período). Um arquivo já ingerido (mesmo SHA-256) não é
+    reprocessado. Ingestões simultâneas (várias sessões ou processos) esperam a vez em _history_lock. Devolve o
+    registro da ingestão ('novos', 'duplicados', 'inicio'/'fim' dos novos, 'meses').
+    """
+    history_dir = history_dir or HISTORY_DIR
+    os.makedirs(history_dir, exist_ok=True)
+    with _history_lock(history_dir):  # manifesto e meses são lidos e regravados: uma ingestão por vez
+        manifest = history_manifest(history_dir)
+        if manifest["files"] and manifest["rules_version"] != PREP_RULES_VERSION:
+            raise ValueError(f"Histórico em {history_dir} gravado com as regras de preparo v{manifest['rules_version']} "
+                             f"(atual: v{PREP_RULES_VERSION}); apague a pasta e carregue os arquivos de novo")
+        done = next((f for f in manifest["files"] if f["hash_sha256"] == sha), None)
+        if done is not None:
+            return {**done, "ja_ingerido": True}
+        month = _parse_unique(clean['Date'], lambda u: pd.to_datetime(u).dt.strftime('%Y-%m'))
+        added, dups, first, last, months = 0, 0, None, None, []
+        for m, part in clean.groupby(month.to_numpy(), sort=True):
+            with profile_stage(profile, f"historico_{m}", len(part)) as rec:
+                path = _history_path(history_dir, m)
+                old = pd.read_parquet(path) if m in manifest["months"] else None
+                keys = _history_keys(part)
+                new_rows = ~keys.duplicated()
+                if old is not None:
+                    new_rows &= ~keys.isin(_history_keys(old))
+                new = part[new_rows]
+                dups += len(part)-len(new)
+                rec['linhas_saida'] = len(new)
+                if new.empty:
+                    continue
+                merged = new if old is None else pd.concat([old, new], ignore_index=True).sort_values('DateTime', kind='stable')
+                _write_atomic(path, partial(_parquet_safe(merged).to_parquet, index=False))
+                info = manifest["months"].get(m, {"version": 0})
+                manifest["months"][m] = {"rows": int(len(merged)), "version": int(info["version"])+1}
+                added += len(new)
+                first = new['DateTime'].min() if first is None else first
+                last = new['DateTime'].max()
+                months.append(m)
+        record = {"hash_sha256": sha, "arquivo": name, "ingerido_em_utc": datetime.utcnow().isoformat()+"Z",
+                  "linhas_validas": int(len(clean)), "novos": int(added), "duplicados": int(dups),
+                  "inicio": None if first is None else str(first), "fim": None if last is None else str(last), "meses": months}
+        manifest["rules_version"] = PREP_RULES_VERSION
+        manifest["files"].append(record)
+        manifest_path = os.path.join(history_dir, "manifest.json")
+        def write_manifest(tmp):
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+        _write_atomic(manifest_path, write_manifest)
+        return {**record, "ja_ingerido": False}
+
+def _history_months(manifest, start=None, end=None):
+    # Meses gravados que cruzam [start, end] (datas inclusivas; None = sem limite)
+    lo = None if start is None else pd.Timestamp(start).strftime('%Y-%m')
+    hi = None if end is None else pd.Timestamp(end).strftime('%Y-%m')
+    return [m for m in sorted(manifest["months"]) if (lo is None or m >= lo) and (hi is None or m <= hi)]
+
+def history_span(manifest):
+    """(primeiro dia, último dia) do histórico, ou None se vazio."""
+    starts = [pd.Timestamp(f["inicio"]) for f in manifest["files"] if f["inicio"]]
+    ends = [pd.Timestamp(f["fim"]) for f in manifest["files"] if f["fim"]]
+    return (min(starts).normalize(), max(ends).normalize()) if starts else None
+
+def history_fingerprint(manifest, start=None, end=None):
+    """Chave do período: muda só quando algum mês do período recebe movimentos novos (substitui o hash do arquivo).
+
+    A granularidade é o mês: qualquer movimento novo em um mês do período invalida os resultados do período todo.
+    """
+    months = [(m, manifest["months"][m]["version"]) for m in _history_months(manifest, start, end)]
+    payload = json.dumps([None if start is None else str(pd.Timestamp(start).date()), None if end is None else str(pd.Timestamp(end).date()),
+                          manifest["rules_version"], months])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def history_load(start=None, end=None, history_dir=None, manifest=None):
+    """Movimentos do histórico entre start e end (datas inclusivas), lendo só os meses do período."""
+    history_dir = history_dir or HISTORY_DIR
+    manifest = history_manifest(history_dir) if manifest is None else manifest
+    parts = [pd.read_parquet(_history_path(history_dir, m)) for m in _history_months(manifest, start, end)]
+    if not parts:
+        return pd.DataFrame(columns=HISTORY_KEY)
+    df = pd.concat(parts, ignore_index=True)
+    mask = np.ones(len(df), dtype=bool)
+    if start is not None:
+        mask &= (df['Date'] >= pd.Timestamp(start).normalize()).to_numpy()
+    if end is not None:
+        mask &= (df['Date'] <= pd.Timestamp(end).normalize()).to_numpy()
+    return _history_frame(df[mask])
+
+def _window_starts(ts, window_min):
+    # Para cada 'end', o primeiro 'start' com ts[end]-ts[start] <= janela (mesmo resultado do two-pointer)
+    return np.searchsorted(ts, ts - np.int64(window_min*60*10**9), side='left')
+
+def _timestamps_ns(df):
+    return df['DateTime'].to_numpy(dtype='datetime64[ns]').view('i8')
+
+def _prefix_sum(values):
+    return np.concatenate(([0], np.cumsum(np.asarray(values, dtype=np.int64))))
+
+def _wide_group_table(df, seq_rows, starts, ends, flight_label, width=None):
+    # Materializa o layout "{i}th DateTime"/"{i}th Flight"; rótulos só para as linhas que aparecem nos grupos pedidos
+    sizes = ends-starts+1
+    width = int(sizes.max()) if width is None else int(width)
+    offs = np.arange(width)
+    valid = offs < sizes[:,None]
+    idx = starts[:,None]+offs
+    rows = np.unique(idx[valid])
+    pos = np.where(valid, np.searchsorted(rows, idx), len(rows))  # len(rows) = sentinela '---'
+    used = df.iloc[seq_rows[rows]]
+    dt_txt = np.full(len(rows)+1, '---', dtype=object)
+    fl_txt = np.full(len(rows)+1, '---', dtype=object)
+    dt_txt[:-1] = used['DateTime'].dt.strftime('%d/%m/%Y %H:%M').to_numpy(dtype=object)
+    fl_txt[:-1] = flight_label(used).to_numpy(dtype=object)
+    data = {}
+    for i in range(width):
+        data[f"{i+1}th DateTime"] = dt_txt[pos[:,i]]
+        data[f"{i+1}th Flight"] = fl_txt[pos[:,i]]
+    return pd.DataFrame(data)
+
+def _flight_label(r):
+    return r['AERONAVE_OPERADOR'].astype(str)+' '+r['Fltno'].astype(str)+' - '+r['Actyp'].astype(str)
+
+def _flight_label_ad(r):
+    return r['AERONAVE_OPERADOR'].astype(str)+' '+r['Fltno'].astype(str)+' '+np.where(r['ArrDep']=='A','(A)','(D)')+' - '+r['Actyp'].astype(str)
+
+def _index_entry(sub, windows):
+    # Para cada movimento: quantos movimentos cabem na janela que termina nele (por janela) + somas prefixadas
+    ts = _timestamps_ns(sub)
+    ends = np.arange(len(sub))
+    arrdep = sub['ArrDep'].to_numpy()
+    return {
+        'sizes': {int(w): (ends-_window_starts(ts, w)+1).astype(np.int32) for w in windows},
+        'pax': _prefix_sum(sub['PAX_LOCAL']),
+        'seats': _prefix_sum(sub['SEATS_OFFERED']),
+        'arr': _prefix_sum(arrdep=='A'),
+        'dep': _prefix_sum(arrdep=='D'),
+    }
+
+def window_index_entry(index, key, df, windows=WINDOW_OPTIONS):
+    """Entrada key ('A', 'D' ou '*') do índice multi-janela, construída e guardada em index na primeira vez."""
+    entry = index.get(key)
+    if entry is None:
+        entry = index[key] = _index_entry(df if key == '*' else df[df['ArrDep']==key], windows)
+    return entry
+
+def build_window_index(df, windows=WINDOW_OPTIONS):
+    """Índice multi-janela do dataset limpo: 'A' e 'D' (consecutivos) e '*' (combinados)."""
+    index = {}
+    for key in ('A', 'D', '*'):
+        window_index_entry(index, key, df, windows)
+    return index
+
+def _lookup_entry(index, key, df, window_min):
+    entry = index.get(key) if index is not None else None
+    if entry is None or int(window_min) not in entry['sizes']:
+        entry = _index_entry(df if key == '*' else df[df['ArrDep']==key], [window_min])
+    return entry, entry['sizes'][int(window_min)]
+
+def _group_frame(starts, ends, entry, **extra):
+    return pd.DataFrame({
+        'start': starts.astype(np.int32), 'end': ends.astype(np.int32), 'size': (ends-starts+1).astype(np.int32),
+        **extra,
+        'PAX (Local)': entry['pax'][ends+1]-entry['pax'][starts],
+        'Seats Offered': entry['seats'][ends+1]-entry['seats'][starts],
+    })
+
+def _size_counts(sizes):
+    # {tamanho: quantidade}, do maior para o menor (ordem do resumo das abas)
+    vals, cnts = np.unique(sizes, return_counts=True)
+    return {int(k): int(v) for k,v in zip(vals[::-1], cnts[::-1])}
+
+def _label_counts(labels):
+    # {rótulo: quantidade}, na ordem de primeira ocorrência
+    codes, uniq = pd.factorize(np.asarray(labels, dtype=object))
+    return dict(zip(uniq.tolist(), np.bincount(codes, minlength=len(uniq)).tolist()))
+
+def cluster_groups(groups, entry):
+    """Funde janelas qualificadas que se sobrepõem (compartilham ao menos um movimento) em clusters máximos.
+
+    Uma linha por cluster: 'start'/'end' do primeiro ao último movimento, 'size' = movimentos no cluster,
+    'Peak Count'/'Peak PAX (Local)' = maiores valores entre as janelas do cluster; 'Combination Type' é o da janela de pico.
+    """
+    s = groups['start'].to_numpy(); e = groups['end'].to_numpy(); size = groups['size'].to_numpy()
+    new = np.concatenate(([True], s[1:] > e[:-1]))[:len(s)]  # 'start'/'end' são crescentes nas janelas
+    first = np.flatnonzero(new)
+    last = np.concatenate((first[1:], [len(s)]))[:len(first)]-1
+    peak = np.lexsort((-size, np.cumsum(new)))[first]  # primeira janela de maior tamanho de cada cluster
+    starts, ends = s[first], e[last]
+    extra = {'Combination Type': groups['Combination Type'].array.take(peak)} if 'Combination Type' in groups.columns else {}
+    pax = groups['PAX (Local)'].to_numpy()
+    return pd.DataFrame({
+        'start': starts, 'end': ends, 'size': (ends-starts+1).astype(np.int32),
+        'Peak Count': size[peak],
+        **extra,
+        'Peak PAX (Local)': np.maximum.reduceat(pax, first) if len(first) else pax[:0],
+        'PAX (Local)': entry['pax'][ends+1]-entry['pax'][starts],
+        'Seats Offered': entry['seats'][ends+1]-entry['seats'][starts],
+    })
+
+def consecutive_group_table(df, tipo, window_min, min_size, min_pax=None, index=None, clusters=False):
+    """Grupos de pousos ('A') ou decolagens ('D') consecutivos em formato compacto: uma linha por grupo.
+
+    'start'/'end' são posições (inclusivas) na sequência de movimentos do tipo, em ordem de DateTime;
+    o layout largo de exibição sai de wide_group_view. A contagem por tamanho ignora min_pax.
+    clusters=True funde janelas sobrepostas (cluster_groups) e conta clusters pelo tamanho de pico.
+    """
+    entry, sizes = _lookup_entry(index, tipo, df, window_min)
+    ends = np.flatnonzero(sizes >= min_size)
+    sizes = sizes[ends]
+    groups = _group_frame(ends-sizes+1, ends, entry)
+    if clusters:
+        merged = cluster_groups(groups, entry)
+        counts = _size_counts(merged['Peak Count'].to_numpy())
+    else:
+        counts = _size_counts(sizes)
+    if min_pax is not None:
+        groups = groups[groups['PAX (Local)'] >= min_pax].reset_index(drop=True)
+    elif clusters:
+        return merged, counts
+    return (cluster_groups(groups, entry) if clusters else groups), counts
+
+def combined_group_table(df, window_min, min_ops, min_pax=None, index=None, clusters=False):
+    """Grupos combinados (A+D) em formato compacto; 'start'/'end' são posições no DataFrame limpo."""
+    entry, sizes = _lookup_entry(index, '*', df, window_min)
+    ends = np.flatnonzero(sizes >= min_ops)
+    starts = ends-sizes[ends]+1
+    a = entry['arr'][ends+1]-entry['arr'][starts]; d = entry['dep'][ends+1]-entry['dep'][starts]
+    keep = (a>0) & (d>0)
+    starts, ends, a, d = starts[keep], ends[keep], a[keep], d[keep]
+    # Um rótulo por combinação distinta, na ordem de primeira ocorrência (mesma ordem do resumo de contagens)
+    codes, pairs = pd.factorize(a*100_000+d)
+    labels = [f"{int(k//100_000)} Pousos e {int(k%100_000)} Decolagens" for k in pairs]
+    counts = dict(zip(labels, np.bincount(codes, minlength=len(labels)).tolist()))
+    groups = _group_frame(starts, ends, entry, **{'Combination Type': pd.Categorical.from_codes(codes, categories=labels)})
+    if clusters:
+        merged = cluster_groups(groups, entry)
+        counts = _label_counts(merged['Combination Type'])
+    if min_pax is not None:
+        groups = groups[groups['PAX (Local)'] >= min_pax].reset_index(drop=True)
+    elif clusters:
+        return merged, counts
+    return (cluster_groups(groups, entry) if clusters else groups), counts
+
+def cluster_view(df, clusters, tipo=None):
+    """Tabela de exibição dos clusters: início/fim, pico, totais e a lista de voos do cluster numa coluna."""
+    seq_rows = np.arange(len(df)) if tipo is None else np.flatnonzero((df['ArrDep']==tipo).to_numpy())
+    s = clusters['start'].to_numpy(); e = clusters['end'].to_numpy()
+    sizes = e-s+1
+    bounds = np.cumsum(sizes)
+    rows = np.arange(bounds[-1])+np.repeat(s-(bounds-sizes), sizes)  # posições de todos os movimentos dos clusters
+    labels = (_flight_label_ad if tipo is None else _flight_label)(df.iloc[seq_rows[rows]]).to_numpy(dtype=object)
+    dt = df['DateTime'].iloc[seq_rows]
+    out = pd.DataFrame({
+        'Start': dt.iloc[s].dt.strftime('%d/%m/%Y %H:%M').to_numpy(dtype=object),
+        'End': dt.iloc[e].dt.strftime('%d/%m/%Y %H:%M').to_numpy(dtype=object),
+        'Movements': sizes,
+    })
+    for col in ['Peak Count','Combination Type','Peak PAX (Local)','PAX (Local)','Seats Offered']:
+        if col in clusters.columns:
+            out[col] = clusters[col].to_numpy(dtype=object if col=='Combination Type' else None)
+    out['Flights'] = [' | '.join(x) for x in np.split(labels, bounds[:-1])]
+    return out
+
+def wide_group_view(df, groups, tipo=None, width=None):
+    """Layout largo ("{i}th DateTime"/"{i}th Flight" + totais) só para os grupos pedidos (ex.: a página exibida).
+
+    tipo='A'/'D' para grupos de consecutive_group_table; None para combined_group_table. Clusters saem via cluster_view.
+    width fixa o número de pares de colunas (padrão: maior grupo pedido).
+    """
+    if groups.empty:
+        return pd.DataFrame()
+    if 'Peak Count' in groups.columns:
+        return cluster_view(df, groups, tipo)
+    seq_rows = np.arange(len(df)) if tipo is None else np.flatnonzero((df['ArrDep']==tipo).to_numpy())
+    out = _wide_group_table(df, seq_rows, groups['start'].to_numpy(), groups['end'].to_numpy(), _flight_label_ad if tipo is None else _flight_label, width)
+    for col in ['Combination Type','PAX (Local)','Seats Offered']:
+        if col in groups.columns:
+            out[col] = groups[col].to_numpy(dtype=object if col=='Combination Type' else None)
+    return out
+
+def wide_group_chunks(df, groups, tipo=None, chunk_rows=None):
+    """wide_group_view em blocos de grupos, todos com a largura do maior grupo (para write_table).
+
+    A memória da exportação acompanha o bloco, não a tabela larga inteira (grupos × maior tamanho): por padrão
+    cada bloco tem até XLSX_STREAM_CHUNK_ROWS linhas e cerca de XLSX_STREAM_MIN_CELLS/10 células.
+    """
+    width = int(groups['size'].max()) if len(groups) else 0
+    chunk_rows = chunk_rows or max(1, min(XLSX_STREAM_CHUNK_ROWS, XLSX_STREAM_MIN_CELLS//10//(2*width+4)))
+    for i in range(0, len(groups), chunk_rows):
+        yield wide_group_view(df, groups.iloc[i:i+chunk_rows], tipo, width)
+
+def consecutive_groups(df, tipo, window_min, min_size, min_pax=None, index=None, clusters=False):
+    groups, counts = consecutive_group_table(df, tipo, window_min, min_size, min_pax, index, clusters)
+    return wide_group_view(df, groups, tipo), counts
+
+def combined_groups(df, window_min, min_ops, min_pax=None, index=None, clusters=False):
+    groups, counts = combined_group_table(df, window_min, min_ops, min_pax, index, clusters)
+    return wide_group_view(df, groups), counts
+
+def _stand_keys(df):
+    # Chave de pareamento pouso→decolagem: operador + tipo de aeronave + BOX (vazio quando ausente)
+    if 'BOX' in df.columns:
+        box = _parse_unique(df['BOX'], lambda u: u.astype('string').str.strip().str.upper().str.replace(r'\.0$', '', regex=True).fillna(''))
+    else:
+        box = pd.Series('', index=df.index)
+    return df.groupby([df['AERONAVE_OPERADOR'], df['AERONAVE_TIPO'], box], observed=True, sort=False, dropna=False).ngroup().to_numpy()
+
+def build_stand_occupancy(df, max_stay_h=STAND_MAX_STAY_H):
+    """Ocupação de posições no pátio por varredura (sweep line) sobre permanências pouso→decolagem.
+
+    Cada pouso é pareado à decolagem seguinte da mesma chave (operador/tipo/BOX, FIFO). Decolagem sem pouso
+    anterior (aeronave já estacionada), pouso sem decolagem e pares mais longos que max_stay_h viram permanências
+    de até max_stay_h, limitadas aos dias do arquivo. Devolve o perfil {'times','level'} (nível vale de times[i]
+    até times[i+1]), 'arr_level' (posições ocupadas logo após cada pouso, alinhado a df) e as contagens de pareamento.
+    """
+    n = len(df)
+    ts = _timestamps_ns(df)
+    is_arr = (df['ArrDep']=='A').to_numpy()
+    key = _stand_keys(df)
+    order = np.argsort(key, kind='stable')  # df já está em ordem de DateTime: fica (chave, DateTime)
+    k = key[order]
+    x = pd.Series(np.where(is_arr[order], 1, -1))
+    # Saldo de aeronaves paradas por chave, truncado em zero: decolagem que renova o mínimo não tem pouso para parear
+    low = np.minimum(x.groupby(k).cumsum().groupby(k).cummin(), 0)
+    orphan_dep = (x.to_numpy() == -1) & (low < low.groupby(k).shift(1, fill_value=0)).to_numpy()
+    paired_dep = (x.to_numpy() == -1) & ~orphan_dep
+    arr_sorted = x.to_numpy() == 1
+    arr_rows, arr_k = order[arr_sorted], k[arr_sorted]
+    # FIFO: a j-ésima decolagem pareada de uma chave leva o j-ésimo pouso da mesma chave
+    dep_rank = pd.Series(paired_dep).groupby(k).cumsum().to_numpy()[paired_dep]-1
+    dep_rows = order[paired_dep]
+    pair_arr = arr_rows[np.searchsorted(arr_k, k[paired_dep])+dep_rank]
+    lone_arr = np.setdiff1d(arr_rows, pair_arr)
+    max_ns = np.int64(max_stay_h*3600*10**9)
+    long_ = ts[dep_rows]-ts[pair_arr] > max_ns
+    short = ~long_
+    lead_arr = np.concatenate((pair_arr[short], pair_arr[long_], lone_arr))
+    tail_dep = np.concatenate((dep_rows[long_], order[orphan_dep]))
+    start = np.concatenate((ts[lead_arr], ts[tail_dep]-max_ns))
+    end = np.concatenate((ts[dep_rows[short]], ts[pair_arr[long_]]+max_ns, ts[lone_arr]+max_ns, ts[tail_dep]))
+    if n:
+        day_ns = np.int64(86400*10**9)
+        start = np.maximum(start, ts[0]//day_ns*day_ns)
+        end = np.minimum(end, (ts[-1]//day_ns+1)*day_ns)
+    link = np.concatenate((lead_arr, np.full(len(tail_dep), -1)))
+    # Eventos ±1; no mesmo instante a saída vem antes da chegada (posição liberada e reocupada não soma duas)
+    ev_t = np.concatenate((start, end))
+    ev_d = np.concatenate((np.ones(len(start), np.int8), -np.ones(len(end), np.int8)))
+    ev_arr = np.concatenate((link, np.full(len(end), -1)))
+    ev = np.lexsort((ev_arr, ev_d, ev_t))
+    t, d, a = ev_t[ev], ev_d[ev], ev_arr[ev]
+    level = np.cumsum(d, dtype=np.int32)
+    arr_level = np.zeros(n, dtype=np.int32)
+    arr_level[a[a >= 0]] = level[a >= 0]
+    last = np.concatenate((t[1:] != t[:-1], [True]))[:len(t)]
+    return {'times': t[last], 'level': level[last], 'arr_level': arr_level,
+            'paired': int(len(dep_rows)), 'lone_arrivals': int(len(lone_arr)), 'orphan_departures': int(orphan_dep.sum())}
+
+def minutes_with_positions(occ):
+    """Minutos com ≥N posições ocupadas, para todo N (Series indexada por N)."""
+    dur = np.diff(occ['times'])/(60*10**9)
+    at_level = np.bincount(occ['level'][:-1], weights=dur, minlength=1)
+    at_least = at_level[::-1].cumsum()[::-1]
+    return pd.Series(at_least[1:], index=pd.RangeIndex(1, len(at_least), name='Positions'), name='Minutes')
+
+def positions_table(df, min_positions=DEFAULT_MIN_POSITIONS, occ=None):
+    """Pousos após os quais ≥ min_positions posições ficaram ocupadas (Date/Time/Last Flight/Positions)."""
+    occ = build_stand_occupancy(df) if occ is None else occ
+    rows = np.flatnonzero(occ['arr_level'] >= min_positions)
+    if len(rows) == 0:
+        return pd.DataFrame()
+    r = df.iloc[rows]
+    minute = pd.Series((r['DateTime']-r['Date']).to_numpy(dtype='timedelta64[m]').astype(np.int64))
+    return pd.DataFrame({
+        'Date': _parse_unique(r['Date'], lambda u: pd.to_datetime(u).dt.strftime('%d/%m/%Y')).to_numpy(dtype=object),
+        'Time': _parse_unique(minute, lambda u: u.map(lambda m: f"{m//60:02d}:{m%60:02d}")).to_numpy(dtype=object),
+        'Last Flight': (r['AERONAVE_OPERADOR'].astype(str)+' '+r['Fltno'].astype(str)).to_numpy(dtype=object),
+        'Positions': occ['arr_level'][rows],
+    })
+
+def days_four_plus_positions(df):
+    return positions_table(df, 4)
+
+def build_kpi_cube(df):
+    """Cubo de KPIs por (Month, Company, ArrDep): operações, PAX_LOCAL e PAX_CONEXAO_DOMESTICO.
+
+    Movimentos com MOVIMENTO_TIPO fora de P/D (ArrDep vazio) ficam no cubo: contam em "Todos", não em pousos/decolagens.
+    """
+    month = _parse_unique(df['Date'], lambda u: pd.to_datetime(u).dt.strftime('%Y-%m'))
+    cube = df.groupby([month.rename('Month'), df['Company'], df['ArrDep']], observed=True, dropna=False).agg(
+        ops=('ArrDep', 'size'), PAX_LOCAL=('PAX_LOCAL', 'sum'), PAX_CONEXAO_DOMESTICO=('PAX_CONEXAO_DOMESTICO', 'sum'))
+    return cube.reset_index()
+
+def slice_kpi_cube(cube, arrdep=None, companies=None):
+    """Fatia do cubo para o filtro da aba de KPIs (arrdep 'A'/'D' ou None = todos)."""
+    mask = np.ones(len(cube), dtype=bool)
+    if arrdep is not None:
+        mask &= (cube['ArrDep'] == arrdep).to_numpy()
+    if companies is not None:
+        mask &= cube['Company'].isin(companies).to_numpy()
+    return cube[mask]
+
+def analysis_key(name, params):
+    # Só os parâmetros usados pela análise (ANALYSIS_PARAMS), normalizados para servir de chave
+    return tuple((k, params[k]) for k in ANALYSIS_PARAMS[name])
+
+def run_analysis(name, df, params, cache=None, progress=None, cancel=None, profile=None):
+    """Uma análise das abas ('A', 'D', 'C' ou 'pos') com progresso por etapa e cancelamento cooperativo.
+
+    cache é o dict por arquivo compartilhado entre análises ('index' multi-janela e 'occupancy' do pátio),
+    completado aqui quando faltar. progress(fração, texto) é chamado entre etapas; com cancel (threading.Event)
+    ligado, a próxima etapa levanta CancelledError. Devolve (grupos, contagens) ou, para 'pos', o DataFrame.
+    Com profile (lista), registra a etapa "analise_<name>".
+    """
+    with profile_stage(profile, f"analise_{name}", len(df)) as rec:
+        out = _run_analysis(name, df, params, cache, progress, cancel)
+        rec['linhas_saida'] = len(out[0] if isinstance(out, tuple) else out)
+    return out
+
+def _run_analysis(name, df, params, cache, progress, cancel):
+    cache = {} if cache is None else cache
+    def step(frac, text):
+        if cancel is not None and cancel.is_set():
+            raise CancelledError(name)
+        if progress is not None:
+            progress(frac, text)
+    if name == 'pos':
+        step(0.05, "pareando pousos e decolagens")
+        if cache.get('occupancy') is None:
+            cache['occupancy'] = build_stand_occupancy(df)
+        step(0.8, f"listando pousos com {int(params['min_positions'])}+ posições")
+        out = positions_table(df, int(params['min_positions']), occ=cache['occupancy'])
+    else:
+        index = cache.setdefault('index', {})
+        step(0.05, "índice multi-janela")
+        window_index_entry(index, '*' if name == 'C' else name, df)
+        step(0.6, "detectando grupos")
+        if name == 'C':
+            out = combined_group_table(df, params['window_min'], int(params['min_comb']), index=index, clusters=params['clusters'],
+                                       min_pax=params['thresh_comb'] if params['only_over_threshold'] else None)
+        else:
+            out = consecutive_group_table(df, name, params['window_min'], int(params['min_consec']), index=index, clusters=params['clusters'],
+                                          min_pax=params['thresh_consec'] if params['only_over_threshold'] else None)
+    step(1.0, "concluído")
+    return out
+
+def analyze_rima(df, window_min=DEFAULT_WINDOW_MIN, min_consec=DEFAULT_MIN_CONSEC, min_comb=DEFAULT_MIN_COMB,
+                 thresh_consec=THRESH_PAX_CONSEC_DEFAULT, thresh_comb=THRESH_PAX_COMBI_DEFAULT,
+                 only_over_threshold=False, index=None, clusters=False, min_positions=DEFAULT_MIN_POSITIONS, occupancy=None, profile=None):
+    """Roda as quatro análises das abas com os mesmos parâmetros da barra lateral (grupos em formato compacto)."""
+    params = {'window_min': window_min, 'min_consec': min_consec, 'min_comb': min_comb, 'thresh_consec': thresh_consec,
+              'thresh_comb': thresh_comb, 'only_over_threshold': only_over_threshold, 'clusters': clusters, 'min_positions': min_positions}
+    cache = {'index': {} if index is None else index, 'occupancy': occupancy}
+    return {name: run_analysis(name, df, params, cache, profile=profile) for name in ANALYSES}
+
+def audit_group_views(df, res):
+    """Tabelas largas do pacote de auditoria como funções sem argumentos que geram blocos (montados só na hora de gravar)."""
+    return (partial(wide_group_chunks, df, res['A'][0], 'A'), partial(wide_group_chunks, df, res['D'][0], 'D'),
+            partial(wide_group_chunks, df, res['C'][0]), res['pos'])
+
+def audit_metadata(sha, window_min, min_consec, min_comb, thresh_consec, thresh_comb, rows_original, rows_clean, rows_discarded, clusters=False, min_positions=DEFAULT_MIN_POSITIONS, profile=None):
+    meta = {"hash_sha256": sha, "hash_prefix": sha[:12], "window_min": int(window_min), "min_consecutivos": int(min_consec), "min_combinados": int(min_comb), "threshold_pax_consecutivos": int(thresh_consec), "threshold_pax_combinados": int(thresh_comb), "clusters": bool(clusters), "min_posicoes": int(min_positions), "generated_at_utc": datetime.utcnow().isoformat()+"Z", "rows_original": int(rows_original), "rows_clean": int(rows_clean), "rows_discarded": int(rows_discarded), "airport": "RIMA", "metric_note": "PAX (Local) = embarque local conforme RIMA"}
+    if profile is not None:
+        meta["perfil"] = list(profile)
+    return meta
+
+def audit_tables(A_df=None, D_df=None, C_df=None, pos_df=None, discarded_df=None, min_positions=DEFAULT_MIN_POSITIONS):
+    """(nome base, tabela) de cada arquivo do pacote, na ordem do ZIP.
+
+    A tabela pode ser um DataFrame ou uma função sem argumentos que devolve um DataFrame ou blocos (write_table).
+    """
+    for name, table in [("pousos_consecutivos", A_df), ("decolagens_consecutivas", D_df), ("operacoes_combinadas", C_df), (f"dias_{int(min_positions)}_posicoes", pos_df)]:
+        if table is not None:
+            yield name, table
+    if discarded_df is not None and len(discarded_df)>0:
+        yield "descartados", discarded_df.rename(columns={'_discard_reason':'Motivo'})
+
+def write_audit_zip(fileobj, meta, A_df=None, D_df=None, C_df=None, pos_df=None, discarded_df=None, fmt="xlsx", with_metadata=True):
+    """Monta o ZIP de auditoria direto em fileobj, um arquivo por vez (sem manter todos os bytes em memória).
+
+    Tabelas vazias ficam de fora. metadata.json vai por último: se meta tiver "perfil", ele sai acrescido do
+    tempo de cada arquivo exportado ("exportar_<nome>"). Com with_metadata=False o ZIP sai só com as tabelas
+    (metadata.json entra depois, com add_audit_metadata). Devolve o perfil das exportações.
+    """
+    exports = []
+    with ZipFile(fileobj, "w", compression=ZIP_DEFLATED) as zf:
+        for name, table in audit_tables(A_df, D_df, C_df, pos_df, discarded_df, meta.get("min_posicoes", DEFAULT_MIN_POSITIONS)):
+            with profile_stage(exports, f"exportar_{name}") as rec:
+                table = table() if callable(table) else table
+                first, chunks = _peek_chunks(table)
+                if first is not None and not first.empty:
+                    with zf.open(f"{name}.{fmt}", "w", force_zip64=True) as dest:
+                        rec['linhas_saida'] = write_table(table if isinstance(table, pd.DataFrame) else chunks, dest, fmt)
+        if with_metadata:
+            _write_audit_metadata(zf, meta, exports)
+    return exports
+
+def _write_audit_metadata(zf, meta, exports):
+    if "perfil" in meta:
+        meta = {**meta, "perfil": list(meta["perfil"]) + list(exports)}
+    zf.writestr("metadata.json", json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8"))
+
+def add_audit_metadata(data, meta, exports=()):
+    """Acrescenta metadata.json (meta desta execução + perfil exports) a um ZIP gravado com with_metadata=False."""
+    out = BytesIO(data)
+    with ZipFile(out, "a", compression=ZIP_DEFLATED) as zf:
+        _write_audit_metadata(zf, meta, exports)
+    return out.getvalue()
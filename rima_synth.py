@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# ================================================
+# RIMA sintético — mesmo esquema do RIMA real, para benchmarks e testes de escala
+# Uso: python rima_synth.py saida.xlsx --dias 30 --movimentos-dia 80 [--seed 0] [--limpo]
+# Formato de saída pela extensão: .xlsx (até ~1 milhão de linhas), .csv ou .parquet (datas como texto AAAA-MM-DD)
+# ================================================
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from rima_core import RIMA_COLUMNS, SEATS_BY_TYPE, EXPORT_FORMATS, write_table
+
+# (operador, participação, tipos de aeronave); ACN = Azul Conecta (C208); GERAL é descartado no preparo
+SYNTH_OPERATORS = (
+    ('AZU', 0.34, ('A20N', 'A320', 'E195', 'E295', 'AT76')),
+    ('GLO', 0.25, ('B738', 'B38M', '738W', 'B737')),
+    ('TAM', 0.22, ('A320', 'A20N', 'A321', 'A21N', 'A319')),
+    ('ACN', 0.08, ('C208',)),
+    ('PAM', 0.07, ('AT45', 'AT75')),
+    ('GERAL', 0.04, ('C208', 'AT45')),
+)
+SYNTH_BANKS = ((7.0, 40, 0.35), (12.5, 50, 0.25), (18.5, 45, 0.4))  # bancos de pico: (hora central, desvio em min, peso)
+SYNTH_BANK_SHARE = 0.6  # fração das chegadas dentro dos bancos; o resto é uniforme entre 05:00 e 24:00
+SYNTH_TURN_MIN = (35, 70)  # solo entre pouso e decolagem (min)
+SYNTH_OVERNIGHT = 0.08  # fração das rotações que pernoitam e decolam entre 05:00 e 08:00 do dia seguinte
+SYNTH_BOXES = 12
+SYNTH_SERVICE = (('J', 0.9), ('C', 0.08), ('P', 0.02))  # 'P' é descartado no preparo
+XLSX_MAX_ROWS = 1_048_575
+
+def synth_rima(days=30, daily_movements=80, seed=0, start="2024-01-01", banks=SYNTH_BANKS, bank_share=SYNTH_BANK_SHARE, messy=True):
+    """RIMA sintético (colunas RIMA_COLUMNS) com rotações pouso→decolagem do mesmo operador/tipo/BOX.
+
+    Cerca de daily_movements movimentos por dia (metade pousos), chegadas concentradas nos bancos de pico.
+    messy=True imita o arquivo real: datas como célula de data/texto, horas 'H:MM'/'HH:MM'/'HH:MM:SS', operadores com
+    caixa e espaços variados, 'p'/'P', PAX não numérico e uma pequena fração de datas/horas inválidas.
+    """
+    rng = np.random.default_rng(seed)
+    n = max(1, int(round(days*daily_movements/2)))
+
+    # Horários (minutos desde start): chegada no banco ou uniforme; partida após o solo ou na manhã seguinte
+    day = rng.integers(0, days, n)
+    w = np.array([b[2] for b in banks], dtype=float)
+    bank = rng.choice(len(banks), n, p=w/w.sum())
+    center = np.array([b[0]*60 for b in banks])[bank]
+    sd = np.array([b[1] for b in banks])[bank]
+    in_bank = rng.random(n) < bank_share
+    arr_min = np.clip(np.where(in_bank, rng.normal(center, sd), rng.uniform(5*60, 24*60, n)), 0, 24*60-1).astype(np.int64) + day*1440
+    overnight = rng.random(n) < SYNTH_OVERNIGHT
+    dep_min = np.where(overnight, (day+1)*1440 + rng.integers(5*60, 8*60, n), arr_min + rng.integers(SYNTH_TURN_MIN[0], SYNTH_TURN_MIN[1]+1, n))
+
+    # Operador, tipo (da tabela de assentos), voo, BOX e passageiros por rotação
+    shares = np.array([o[1] for o in SYNTH_OPERATORS])
+    op = rng.choice(len(SYNTH_OPERATORS), n, p=shares/shares.sum())
+    n_types = np.array([len(o[2]) for o in SYNTH_OPERATORS])
+    type_names = np.array([t for o in SYNTH_OPERATORS for t in o[2]], dtype=object)
+    actyp = type_names[(np.cumsum(n_types)-n_types)[op] + (rng.random(n)*n_types[op]).astype(int)]
+    operator = np.array([o[0] for o in SYNTH_OPERATORS], dtype=object)[op]
+    seats = pd.Series(actyp).map(lambda t: SEATS_BY_TYPE.get(t, 176)).to_numpy()
+    flight = rng.integers(500, 5000, n)*2
+    box = rng.integers(1, SYNTH_BOXES+1, n)
+    svc_names, svc_p = zip(*SYNTH_SERVICE)
+    service = np.array(svc_names, dtype=object)[rng.choice(len(svc_names), n, p=svc_p)]
+    load = rng.uniform(0.55, 0.95, n)
+
+    keep_dep = dep_min < days*1440  # partidas após o fim do período ficam fora do arquivo
+    sel = np.concatenate((np.arange(n), np.flatnonzero(keep_dep)))
+    m = len(sel)
+    minutes = np.concatenate((arr_min, dep_min[keep_dep]))
+    is_arr = np.arange(m) < n
+    order = np.argsort(minutes, kind='stable')
+    sel, minutes, is_arr = sel[order], minutes[order], is_arr[order]
+    pax = (seats[sel]*load[sel]*rng.uniform(0.6, 1.0, m)).astype(np.int64)
+
+    df = pd.DataFrame({
+        'AERONAVE_OPERADOR': operator[sel],
+        'MOVIMENTO_TIPO': np.where(is_arr, 'P', 'D').astype(object),
+        'VOO_NUMERO': flight[sel] + ~is_arr,
+        'AERONAVE_TIPO': actyp[sel],
+        'SERVICE_TYPE': service[sel],
+        'PAX_LOCAL': pax,
+        'PAX_CONEXAO_DOMESTICO': (seats[sel]*load[sel]*rng.uniform(0.0, 0.2, m)).astype(np.int64),
+        'BOX': box[sel],
+        'CABECEIRA': np.where(rng.random(m) < 0.7, '14', '32').astype(object),
+    })
+
+    # Data e hora a partir de tabelas por dia / por minuto do dia (sem formatar milhões de timestamps)
+    days_idx = pd.date_range(start, periods=days, freq='D')
+    d, mod = minutes//1440, minutes % 1440
+    hhmmss = np.array([f"{i//60:02d}:{i%60:02d}:00" for i in range(1440)], dtype=object)
+    if messy:
+        # Data: célula de data ou texto ISO (textos em formatos diferentes na mesma coluna o parser descarta)
+        dates = np.stack([days_idx.to_pydatetime().astype(object),
+                          days_idx.strftime('%Y-%m-%d').to_numpy(dtype=object)])
+        times = np.stack([hhmmss,
+                          np.array([f"{i//60:02d}:{i%60:02d}" for i in range(1440)], dtype=object),
+                          np.array([f"{i//60}:{i%60:02d}" for i in range(1440)], dtype=object)])
+        df['CALCO_DATA'] = dates[rng.integers(0, 2, m), d]
+        df['CALCO_HORARIO'] = times[rng.integers(0, 3, m), mod]
+        noisy = rng.random(m) < 0.05
+        df.loc[noisy, 'AERONAVE_OPERADOR'] = df.loc[noisy, 'AERONAVE_OPERADOR'].str.lower() + ' '
+        df.loc[(rng.random(m) < 0.1) & is_arr, 'MOVIMENTO_TIPO'] = 'p'
+        df['PAX_LOCAL'] = df['PAX_LOCAL'].astype(object)
+        df.loc[rng.random(m) < 0.01, 'PAX_LOCAL'] = 'n/a'
+        df.loc[rng.random(m) < 0.003, 'CALCO_HORARIO'] = 'xx'
+        df.loc[rng.random(m) < 0.002, 'CALCO_DATA'] = 'bad'
+    else:
+        df['CALCO_DATA'] = days_idx.to_pydatetime().astype(object)[d]
+        df['CALCO_HORARIO'] = hhmmss[mod]
+    return df[RIMA_COLUMNS]
+
+def synth_for_format(df, fmt):
+    """RIMA sintético pronto para gravar em fmt: em csv/parquet, CALCO_DATA vira texto num único formato (AAAA-MM-DD).
+
+    Célula de data e texto ISO só convivem no XLSX; gravados como texto viram "2024-01-01 00:00:00" e "2024-01-01",
+    e o preparo descartaria as linhas de um dos formatos.
+    """
+    if fmt == 'xlsx':
+        return df
+    codes, uniques = pd.factorize(df['CALCO_DATA'], use_na_sentinel=False)
+    text = np.array([v.strftime('%Y-%m-%d') if isinstance(v, datetime) else v for v in uniques], dtype=object)
+    return df.assign(CALCO_DATA=text[codes])
+
+def write_synth_rima(df, path):
+    """Grava o RIMA sintético; formato pela extensão (xlsx, csv ou parquet)."""
+    fmt = os.path.splitext(path)[1].lower().lstrip('.')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Extensão não suportada: {path} (use {', '.join(EXPORT_FORMATS)})")
+    if fmt == 'xlsx' and len(df) > XLSX_MAX_ROWS:
+        raise ValueError(f"{len(df)} linhas não cabem numa planilha XLSX; use .csv ou .parquet")
+    with open(path, 'wb') as f:
+        write_table(synth_for_format(df, fmt), f, fmt, sheet="RIMA")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Gera um arquivo RIMA sintético com o esquema real.")
+    ap.add_argument("saida", help="Arquivo de saída (.xlsx, .csv ou .parquet)")
+    ap.add_argument("--dias", type=int, default=30, help="Dias cobertos (padrão: 30)")
+    ap.add_argument("--movimentos-dia", type=int, default=80, help="Movimentos por dia, pousos + decolagens (padrão: 80)")
+    ap.add_argument("--participacao-bancos", type=float, default=SYNTH_BANK_SHARE, help="Fração das chegadas nos bancos de pico")
+    ap.add_argument("--inicio", default="2024-01-01", help="Primeiro dia (AAAA-MM-DD)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--limpo", action="store_true", help="Sem formatos mistos nem linhas inválidas")
+    args = ap.parse_args(argv)
+    df = synth_rima(args.dias, args.movimentos_dia, args.seed, args.inicio, bank_share=args.participacao_bancos, messy=not args.limpo)
+    try:
+        write_synth_rima(df, args.saida)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"{args.saida}: {len(df)} linhas")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
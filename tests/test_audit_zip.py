@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Pacote de auditoria: tabelas gravadas uma vez (cache do app) + metadata.json da execução atual
+
+import json
+from io import BytesIO
+from zipfile import ZipFile
+
+from rima_core import prepare_rima_dataframe, positions_table, write_audit_zip, add_audit_metadata
+from rima_synth import synth_rima
+
+
+def test_audit_zip_metadata_added_after_cached_tables():
+    df, _, _ = prepare_rima_dataframe(synth_rima(days=2, daily_movements=60, seed=4, messy=False))
+    pos = positions_table(df, 1)
+    assert list(pos.columns) == ['Date', 'Time', 'Last Flight', 'Positions']
+    out = BytesIO()
+    exports = write_audit_zip(out, {"min_posicoes": 1}, pos_df=pos, fmt="csv", with_metadata=False)
+    assert ZipFile(BytesIO(out.getvalue())).namelist() == ["dias_1_posicoes.csv"]
+
+    meta = {"min_posicoes": 1, "generated_at_utc": "agora", "perfil": [{"etapa": "carregar_dados"}]}
+    zf = ZipFile(BytesIO(add_audit_metadata(out.getvalue(), meta, exports)))
+    assert zf.namelist() == ["dias_1_posicoes.csv", "metadata.json"]
+    assert zf.read("dias_1_posicoes.csv").decode("utf-8-sig").splitlines()[0] == "Date;Time;Last Flight;Positions"
+    saved = json.loads(zf.read("metadata.json"))
+    assert saved["generated_at_utc"] == "agora"
+    assert [r["etapa"] for r in saved["perfil"]][:2] == ["carregar_dados", "exportar_dias_1_posicoes"]
+    assert next(r for r in saved["perfil"] if r["etapa"] == "exportar_dias_1_posicoes")["linhas_saida"] == len(pos)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Modo cluster (janelas sobrepostas fundidas) contra um laço simples de fusão
+
+import pytest
+
+from rima_core import prepare_rima_dataframe, consecutive_group_table, combined_group_table
+from rima_synth import synth_rima
+
+
+def oracle_clusters(windows):
+    # Funde janelas consecutivas que compartilham ao menos um movimento
+    out = []
+    for w in windows.to_dict('records'):
+        if out and w['start'] <= out[-1]['end']:
+            c = out[-1]
+            c['end'] = max(c['end'], w['end'])
+            c['Peak PAX (Local)'] = max(c['Peak PAX (Local)'], w['PAX (Local)'])
+            if w['size'] > c['Peak Count']:
+                c['Peak Count'], c['type'] = w['size'], w.get('Combination Type')
+        else:
+            out.append({'start': w['start'], 'end': w['end'], 'Peak Count': w['size'],
+                        'Peak PAX (Local)': w['PAX (Local)'], 'type': w.get('Combination Type')})
+    return out
+
+@pytest.fixture(scope="module")
+def df():
+    clean, _, _ = prepare_rima_dataframe(synth_rima(days=6, daily_movements=120, seed=5, messy=False))
+    return clean
+
+def tables(df, kind, min_pax, clusters):
+    if kind == 'C':
+        return combined_group_table(df, 45, 4, min_pax=min_pax, clusters=clusters)
+    return consecutive_group_table(df, kind, 45, 3, min_pax=min_pax, clusters=clusters)
+
+
+@pytest.mark.parametrize("kind", ['A', 'D', 'C'])
+@pytest.mark.parametrize("min_pax", [None, 300])
+def test_clusters_match_merge_loop(df, kind, min_pax):
+    windows, _ = tables(df, kind, min_pax, clusters=False)
+    clusters, _ = tables(df, kind, min_pax, clusters=True)
+    expected = oracle_clusters(windows)
+    assert len(expected) > 0
+    assert clusters['start'].tolist() == [c['start'] for c in expected]
+    assert clusters['end'].tolist() == [c['end'] for c in expected]
+    assert clusters['Peak Count'].tolist() == [c['Peak Count'] for c in expected]
+    assert clusters['Peak PAX (Local)'].tolist() == [c['Peak PAX (Local)'] for c in expected]
+    assert (clusters['size'] == clusters['end']-clusters['start']+1).all()
+    if kind == 'C':
+        assert clusters['Combination Type'].astype(str).tolist() == [c['type'] for c in expected]
+
+
+@pytest.mark.parametrize("kind", ['A', 'D', 'C'])
+def test_cluster_counts_ignore_pax_filter(df, kind):
+    clusters, counts = tables(df, kind, None, clusters=True)
+    filtered, counts_filtered = tables(df, kind, 300, clusters=True)
+    assert counts_filtered == counts
+    assert (filtered['Peak PAX (Local)'] >= 300).all()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Cache em disco dos dados preparados: ida e volta pelo Parquet e descarte LRU por mtime
+
+import os
+
+import pandas as pd
+import pytest
+
+import rima_core
+from rima_core import prepare_rima_dataframe, disk_cache_get, disk_cache_put, _evict_cache
+from rima_synth import synth_rima
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(rima_core, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+@pytest.fixture(scope="module")
+def prepared():
+    raw = synth_rima(days=3, daily_movements=40, seed=3, messy=False)
+    clean, discarded, _ = prepare_rima_dataframe(raw)
+    return clean, discarded, len(raw)
+
+def entry_files(cache_dir, sha):
+    return sorted(p for p in os.listdir(cache_dir) if p.startswith(sha+"-"))
+
+def set_mtime(cache_dir, sha, t):
+    for name in entry_files(cache_dir, sha):
+        os.utime(os.path.join(cache_dir, name), (t, t))
+
+
+def test_round_trip_keeps_clean_frame_and_row_count(cache_dir, prepared):
+    clean, discarded, rows = prepared
+    assert disk_cache_get("a"*64) is None
+    disk_cache_put("a"*64, clean, discarded, rows)
+    assert len(entry_files(cache_dir, "a"*64)) == 3
+    cached_clean, _, cached_rows = disk_cache_get("a"*64)
+    pd.testing.assert_frame_equal(cached_clean, clean)
+    assert cached_rows == rows
+    assert disk_cache_get("a"*64, version=rima_core.PREP_RULES_VERSION+1) is None
+
+
+def test_least_recently_read_entry_is_evicted_first(cache_dir, prepared):
+    clean, discarded, rows = prepared
+    for i, sha in enumerate(("a"*64, "b"*64, "c"*64)):
+        disk_cache_put(sha, clean, discarded, rows)
+        set_mtime(cache_dir, sha, 1_000_000+i*1000)  # gravadas em ordem a, b, c
+    assert disk_cache_get("a"*64) is not None  # leitura renova a: b passa a ser a mais antiga
+    sizes = {sha: sum(os.path.getsize(os.path.join(cache_dir, n)) for n in entry_files(cache_dir, sha)) for sha in ("a"*64, "b"*64, "c"*64)}
+    _evict_cache(max_bytes=sum(sizes.values())-1)
+    assert entry_files(cache_dir, "b"*64) == []
+    assert len(entry_files(cache_dir, "a"*64)) == len(entry_files(cache_dir, "c"*64)) == 3
+    _evict_cache(max_bytes=sizes["a"*64])
+    assert entry_files(cache_dir, "c"*64) == []
+    assert len(entry_files(cache_dir, "a"*64)) == 3
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Histórico acumulado: ingestão por mês sem duplicar movimentos
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from rima_core import read_rima_and_hash, prepare_rima_dataframe, history_ingest, history_manifest, history_load
+
+RIMA_CSV_HEADER = "AERONAVE_OPERADOR;MOVIMENTO_TIPO;CALCO_DATA;CALCO_HORARIO;VOO_NUMERO;AERONAVE_TIPO;SERVICE_TYPE;PAX_LOCAL\n"
+
+
+def _clean(day, flights):
+    csv = RIMA_CSV_HEADER + "".join(f"AZU;P;{day:02d}/01/2024;10:{i:02d};{i:04d};A320;J;100\n" for i in flights)
+    raw, sha = read_rima_and_hash(csv.encode("utf-8"), "rima.csv")
+    clean, _, _ = prepare_rima_dataframe(raw)
+    return clean, sha
+
+
+def test_concurrent_ingests_keep_every_file(tmp_path):
+    files = [_clean(day, range(day, day+5)) for day in range(1, 9)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda f: history_ingest(f[0], f[1], history_dir=str(tmp_path)), files))
+    manifest = history_manifest(str(tmp_path))
+    assert sorted(f["hash_sha256"] for f in manifest["files"]) == sorted(sha for _, sha in files)
+    assert manifest["months"]["2024-01"] == {"rows": 40, "version": 8}
+    assert len(history_load(history_dir=str(tmp_path), manifest=manifest)) == 40
+    assert not (tmp_path / "ingest.lock").exists()
+
+
+def test_reingest_same_file_is_noop(tmp_path):
+    clean, sha = _clean(3, range(3))
+    first = history_ingest(clean, sha, history_dir=str(tmp_path))
+    again = history_ingest(clean, sha, history_dir=str(tmp_path))
+    assert first["novos"] == 3 and not first["ja_ingerido"]
+    assert again["ja_ingerido"] and history_manifest(str(tmp_path))["months"]["2024-01"]["version"] == 1
+    assert pd.Timestamp(again["inicio"]) == pd.Timestamp("2024-01-03 10:00")
+
+
+def test_movement_without_arrdep_stays_nan(tmp_path):
+    csv = (RIMA_CSV_HEADER + "AZU;P;05/01/2024;10:00;1234;A320;J;100\n"
+           "AZU;X;05/01/2024;11:00;1235;A320;J;90\n").encode("utf-8")
+    raw, sha = read_rima_and_hash(csv, "rima.csv")
+    clean, _, _ = prepare_rima_dataframe(raw)
+    history_ingest(clean, sha, history_dir=str(tmp_path))
+    loaded = history_load(history_dir=str(tmp_path))
+    assert loaded['ArrDep'].isna().tolist() == [False, True]
+    assert list(loaded['ArrDep'].cat.categories) == ['A']
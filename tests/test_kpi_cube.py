@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Cubo de KPIs contra as somas diretas sobre o DataFrame preparado
+
+import pytest
+
+from rima_core import prepare_rima_dataframe, build_kpi_cube, slice_kpi_cube
+from rima_synth import synth_rima
+
+
+@pytest.mark.parametrize("arrdep", [None, 'A', 'D'])
+def test_kpi_cube_matches_direct_sums(arrdep):
+    raw = synth_rima(days=10, daily_movements=40, seed=2, messy=False)
+    raw.loc[raw.index[:10], 'MOVIMENTO_TIPO'] = 'X'  # nem P nem D: entra só em "Todos"
+    df, _, _ = prepare_rima_dataframe(raw)
+    sub = df if arrdep is None else df[df['ArrDep'] == arrdep]
+    cube = slice_kpi_cube(build_kpi_cube(df), arrdep)
+    assert int(cube['ops'].sum()) == len(sub)
+    for col in ['PAX_LOCAL', 'PAX_CONEXAO_DOMESTICO']:
+        assert int(cube[col].sum()) == int(sub[col].sum())
+    totals = cube.groupby('Company', observed=True)['PAX_LOCAL'].sum()
+    assert totals.to_dict() == sub.groupby('Company', observed=True)['PAX_LOCAL'].sum().to_dict()
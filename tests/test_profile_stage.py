@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Perfil por etapa: pico de RSS zerado a cada etapa e repassado das internas para a externa
+
+import numpy as np
+import pytest
+
+from rima_core import profile_stage, _reset_peak_rss
+
+pytestmark = pytest.mark.skipif(not _reset_peak_rss(), reason="pico de RSS por etapa só no Linux")
+
+
+def allocate(mb):
+    block = np.ones(mb*2**20, dtype=np.uint8)  # páginas tocadas: entram no RSS
+    return int(block[-1])
+
+
+def test_peak_is_per_stage_and_bubbles_up():
+    profile = []
+    with profile_stage(profile, "externa"):
+        with profile_stage(profile, "grande"):
+            allocate(200)
+        with profile_stage(profile, "pequena"):
+            allocate(10)
+    rec = {r['etapa']: r for r in profile}
+    assert [r['etapa'] for r in profile] == ["grande", "pequena", "externa"]
+    # A alocação de 200 MB já foi liberada: só o pico a registra, e não vaza para a etapa seguinte
+    assert rec["grande"]['pico_rss_mb'] - rec["grande"]['rss_mb'] > 150
+    assert rec["pequena"]['pico_rss_mb'] < rec["grande"]['pico_rss_mb'] - 150
+    assert rec["externa"]['pico_rss_mb'] >= rec["grande"]['pico_rss_mb']
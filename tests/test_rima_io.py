@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Leitura de arquivos RIMA (formatos de entrada) até o DataFrame preparado
+
+import pandas as pd
+
+from rima_core import read_rima_and_hash, prepare_rima_dataframe
+
+RIMA_CSV_HEADER = "AERONAVE_OPERADOR;MOVIMENTO_TIPO;CALCO_DATA;CALCO_HORARIO;VOO_NUMERO;AERONAVE_TIPO;SERVICE_TYPE;PAX_LOCAL\n"
+
+
+def test_csv_semicolon_dates_are_day_first():
+    csv = (RIMA_CSV_HEADER +
+           "AZU;P;05/01/2024;10:00;1234;A320;J;100\n"
+           "AZU;D;13/01/2024;11:00;1235;A320;J;90\n"
+           "GLO;P;2024-01-14;12:00;0123;B738;J;5\n").encode("utf-8")
+    raw, _ = read_rima_and_hash(csv, "rima.csv")
+    clean, discarded, _ = prepare_rima_dataframe(raw)
+    assert discarded.empty
+    assert clean['DateTime'].tolist() == [pd.Timestamp('2024-01-05 10:00'), pd.Timestamp('2024-01-13 11:00'), pd.Timestamp('2024-01-14 12:00')]
+    assert clean['VOO_NUMERO'].astype(str).tolist() == ['1234', '1235', '0123']
+
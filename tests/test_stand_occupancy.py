@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Ocupação de posições (pareamento pouso→decolagem + varredura) em casos montados à mão
+
+import pandas as pd
+
+from rima_core import STAND_MAX_STAY_H, build_stand_occupancy, minutes_with_positions, positions_table
+
+
+def frame(rows):
+    """rows: (DateTime, 'A'/'D', operador, tipo, BOX, voo), já em ordem de DateTime."""
+    df = pd.DataFrame(rows, columns=['DateTime', 'ArrDep', 'AERONAVE_OPERADOR', 'AERONAVE_TIPO', 'BOX', 'Fltno'])
+    df['DateTime'] = pd.to_datetime(df['DateTime'])
+    df['Date'] = df['DateTime'].dt.normalize()
+    return df
+
+def minutes(occ):
+    return minutes_with_positions(occ).to_dict()
+
+
+def test_paired_stay():
+    occ = build_stand_occupancy(frame([
+        ('2024-01-05 10:00', 'A', 'AZU', 'A320', '7', '1000'),
+        ('2024-01-05 11:30', 'D', 'AZU', 'A320', '7', '1001'),
+    ]))
+    assert (occ['paired'], occ['lone_arrivals'], occ['orphan_departures']) == (1, 0, 0)
+    assert minutes(occ) == {1: 90}
+    assert occ['arr_level'].tolist() == [1, 0]
+
+
+def test_orphan_departure_is_clipped_to_first_day():
+    # Aeronave já estacionada: permanência de até 12 h antes da decolagem, mas não antes do início do arquivo
+    occ = build_stand_occupancy(frame([('2024-01-05 05:00', 'D', 'AZU', 'A320', '7', '1001')]))
+    assert (occ['paired'], occ['lone_arrivals'], occ['orphan_departures']) == (0, 0, 1)
+    assert minutes(occ) == {1: 5*60}
+
+
+def test_orphan_departure_before_a_pair_of_same_key():
+    occ = build_stand_occupancy(frame([
+        ('2024-01-05 06:00', 'D', 'AZU', 'A320', '7', '1001'),
+        ('2024-01-05 08:00', 'A', 'AZU', 'A320', '7', '1002'),
+        ('2024-01-05 10:00', 'D', 'AZU', 'A320', '7', '1003'),
+    ]))
+    assert (occ['paired'], occ['lone_arrivals'], occ['orphan_departures']) == (1, 0, 1)
+    assert minutes(occ) == {1: 6*60+2*60}
+
+
+def test_lone_arrival_near_midnight_is_clipped_to_last_day():
+    occ = build_stand_occupancy(frame([('2024-01-05 23:00', 'A', 'AZU', 'A320', '7', '1000')]))
+    assert (occ['paired'], occ['lone_arrivals'], occ['orphan_departures']) == (0, 1, 0)
+    assert minutes(occ) == {1: 60}
+
+
+def test_pair_longer_than_max_stay_becomes_two_capped_stays():
+    occ = build_stand_occupancy(frame([
+        ('2024-01-05 01:00', 'A', 'AZU', 'A320', '7', '1000'),
+        ('2024-01-06 20:00', 'D', 'AZU', 'A320', '7', '1001'),
+    ]))
+    assert occ['paired'] == 1
+    # 01:00→13:00 no dia 5 e 08:00→20:00 no dia 6; o intervalo entre eles fica vazio
+    assert minutes(occ) == {1: 2*STAND_MAX_STAY_H*60}
+    assert occ['level'].tolist() == [1, 0, 1, 0]
+
+
+def test_different_box_or_type_do_not_pair():
+    occ = build_stand_occupancy(frame([
+        ('2024-01-05 10:00', 'A', 'AZU', 'A320', '7', '1000'),
+        ('2024-01-05 11:00', 'D', 'AZU', 'A320', '8', '1001'),  # outro BOX
+        ('2024-01-05 12:00', 'A', 'GLO', 'B738', '9', '2000'),
+        ('2024-01-05 13:00', 'D', 'GLO', 'B38M', '9', '2001'),  # outro tipo
+    ]))
+    assert (occ['paired'], occ['lone_arrivals'], occ['orphan_departures']) == (0, 2, 2)
+    # Pousos 10:00→22:00 e 12:00→24:00; decolagens órfãs 00:00→11:00 e 01:00→13:00
+    assert minutes(occ) == {1: 24*60, 2: 21*60, 3: 2*60}
+
+
+def test_departure_before_arrival_at_same_minute():
+    df = frame([
+        ('2024-01-05 08:00', 'A', 'AZU', 'A320', '7', '1000'),
+        ('2024-01-05 10:00', 'A', 'GLO', 'B738', '9', '2000'),
+        ('2024-01-05 10:00', 'D', 'AZU', 'A320', '7', '1001'),
+        ('2024-01-05 12:00', 'D', 'GLO', 'B738', '9', '2001'),
+    ])
+    occ = build_stand_occupancy(df)
+    assert occ['paired'] == 2
+    # A posição liberada às 10:00 é reocupada no mesmo minuto: nunca há duas ao mesmo tempo
+    assert minutes(occ) == {1: 4*60}
+    assert occ['arr_level'].tolist() == [1, 1, 0, 0]
+    table = positions_table(df, 1, occ)
+    assert table.to_dict('list') == {'Date': ['05/01/2024', '05/01/2024'], 'Time': ['08:00', '10:00'],
+                                     'Last Flight': ['AZU 1000', 'GLO 2000'], 'Positions': [1, 1]}
+    assert positions_table(df, 2, occ).empty
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Motor de janelas (searchsorted + somas prefixadas) contra os laços originais (two-pointer/iterrows) como oráculo
+
+import pandas as pd
+import pytest
+
+from rima_core import WINDOW_OPTIONS, prepare_rima_dataframe, consecutive_groups, combined_groups
+from rima_synth import synth_rima
+
+
+def oracle_consecutive_groups(df, tipo, window_min, min_size):
+    sub = df[df['ArrDep']==tipo].reset_index(drop=True)
+    res, counts, start = [], {}, 0
+    for end in range(len(sub)):
+        while (sub.loc[end,'DateTime'] - sub.loc[start,'DateTime']).total_seconds() > window_min*60:
+            start += 1
+        size = end-start+1
+        if size>=min_size:
+            counts[size] = counts.get(size,0)+1
+            block=sub.iloc[start:end+1]
+            rec={}
+            for i, (_, r) in enumerate(block.iterrows(), start=1):
+                rec[f"{i}th DateTime"]=r['DateTime'].strftime('%d/%m/%Y %H:%M')
+                rec[f"{i}th Flight"]=f"{r['AERONAVE_OPERADOR']} {r['Fltno']} - {r['Actyp']}"
+            rec['PAX (Local)']=int(block['PAX_LOCAL'].sum())
+            rec['Seats Offered']=int(block['SEATS_OFFERED'].sum())
+            res.append(rec)
+    out=pd.DataFrame(res).fillna('---')
+    if not out.empty:
+        cols=[c for c in out.columns if c not in ['PAX (Local)','Seats Offered']]
+        out=out[cols+['PAX (Local)','Seats Offered']]
+    return out, dict(sorted(counts.items(), reverse=True))
+
+def oracle_combined_groups(df, window_min, min_ops):
+    res, counts, start = [], {}, 0
+    for end in range(len(df)):
+        while (df.loc[end,'DateTime'] - df.loc[start,'DateTime']).total_seconds() > window_min*60:
+            start += 1
+        block=df.iloc[start:end+1]
+        if len(block)>=min_ops:
+            a=(block['ArrDep']=='A').sum(); d=(block['ArrDep']=='D').sum()
+            if a>0 and d>0:
+                combo=f"{int(a)} Pousos e {int(d)} Decolagens"
+                counts[combo]=counts.get(combo,0)+1
+                rec={}
+                for i,(_,r) in enumerate(block.iterrows(), start=1):
+                    sig="(A)" if r['ArrDep']=='A' else "(D)"
+                    rec[f"{i}th DateTime"]=r['DateTime'].strftime('%d/%m/%Y %H:%M')
+                    rec[f"{i}th Flight"]=f"{r['AERONAVE_OPERADOR']} {r['Fltno']} {sig} - {r['Actyp']}"
+                rec['Combination Type']=combo
+                rec['PAX (Local)']=int(block['PAX_LOCAL'].sum())
+                rec['Seats Offered']=int(block['SEATS_OFFERED'].sum())
+                res.append(rec)
+    out=pd.DataFrame(res).fillna('---')
+    if not out.empty:
+        cols=[c for c in out.columns if c not in ['Combination Type','PAX (Local)','Seats Offered']]
+        out=out[cols+['Combination Type','PAX (Local)','Seats Offered']]
+    return out, counts
+
+
+@pytest.fixture(scope="module")
+def rima_df():
+    # Dois dias com bancos de pico apertados: grupos de vários tamanhos em todas as janelas
+    clean, _, _ = prepare_rima_dataframe(synth_rima(days=2, daily_movements=120, seed=7, messy=False))
+    return clean
+
+def assert_same_table(new, old):
+    assert list(new.columns) == list(old.columns)
+    pd.testing.assert_frame_equal(new.astype(object).reset_index(drop=True), old.astype(object).reset_index(drop=True), check_dtype=False)
+
+@pytest.mark.parametrize("window_min", WINDOW_OPTIONS)
+@pytest.mark.parametrize("tipo", ['A', 'D'])
+@pytest.mark.parametrize("min_size", [2, 3, 5])
+def test_consecutive_groups_match_oracle(rima_df, window_min, tipo, min_size):
+    new, new_counts = consecutive_groups(rima_df, tipo, window_min, min_size)
+    old, old_counts = oracle_consecutive_groups(rima_df, tipo, window_min, min_size)
+    assert_same_table(new, old)
+    assert list(new_counts.items()) == list(old_counts.items())
+
+@pytest.mark.parametrize("window_min", WINDOW_OPTIONS)
+@pytest.mark.parametrize("min_ops", [3, 4, 6])
+def test_combined_groups_match_oracle(rima_df, window_min, min_ops):
+    new, new_counts = combined_groups(rima_df, window_min, min_ops)
+    old, old_counts = oracle_combined_groups(rima_df, window_min, min_ops)
+    assert_same_table(new, old)
+    assert list(new_counts.items()) == list(old_counts.items())